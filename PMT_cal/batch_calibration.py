@@ -0,0 +1,160 @@
+##################################################
+# Calibrate PMT gain at every HV setting found in
+# the data directory and fit gain vs. voltage
+# with a power law, G = a*V^b.
+#
+# Expects the layout written by sweep_and_acquire:
+#   data/scope_data_%1.2fV/Chan%02d_%1.2fV.dat
+##################################################
+import calibration
+import pm_data
+import plot_render
+import bootstrap
+# Standard stuff
+import optparse
+import multiprocessing
+import glob
+import time
+import sys
+import os
+import numpy as np
+import scipy.optimize
+
+def find_scans(dataDir, channel):
+    """Return scope scan files for a channel, sorted by voltage"""
+    pattern = os.path.join(dataDir, "scope_data_*V", "Chan%02d_*V.dat" % channel)
+    return sorted(glob.glob(pattern), key=calibration.scan_voltage)
+
+def analyse(args):
+    """Run calibration.analyse_scan on one scan; for use with Pool.map"""
+    scopeFile, head, pm, powerFile, clip_samples, max_clipped, use_cache, drop_last, n_boot, seed = args
+    return calibration.analyse_scan(scopeFile, head, pm, powerFile, clip_samples, max_clipped,
+                                    workers=1, use_cache=use_cache, drop_last=drop_last, n_boot=n_boot, seed=seed)
+
+def power_law(v, a, b):
+    return a*np.power(v, b)
+
+def fit_power_law(volts, gain, gainErr):
+    """Fit G = a*V^b. Returns pars and covariance.
+    A straight line fit in log-log space provides the starting point.
+    """
+    b0, loga0 = np.polyfit(np.log(volts), np.log(gain), 1)
+    sigma = gainErr if np.all(gainErr > 0) else None
+    return scipy.optimize.curve_fit(power_law, volts, gain, p0=[np.exp(loga0), b0],
+                                    sigma=sigma, absolute_sigma=sigma is not None)
+
+def write_table(fileName, results, pars, cov):
+    """Write gain vs. voltage table, with the fit in the header (pars None
+    if there was no fit)
+    """
+    with open(fileName, 'w') as file:
+        if pars is None:
+            file.write("#Fit: none, fewer than 2 voltages with a gain\n")
+        else:
+            errs = np.sqrt(np.diag(cov))
+            file.write("#Fit: G = a*V^b, a = %.4e +/- %.2e, b = %.4f +/- %.4f\n" % (pars[0], errs[0], pars[1], errs[1]))
+        file.write("#VOLTAGE\tGAIN\tGAIN Error\tN POINTS\tFIT\tBOOT Error\tCL95 LO\tCL95 HI\n")
+        for res in results:
+            file.write("%1.2f\t%.4e\t%.4e\t%i\t%.4e\t%.4e\t%.4e\t%.4e\n" % (res["voltage"], res["final_gain"],
+                       res["final_gain_err"], len(res["gain"]),
+                       np.nan if pars is None else power_law(res["voltage"], *pars),
+                       res.get("boot_mean_err", np.nan), res.get("boot_mean_lo", np.nan),
+                       res.get("boot_mean_hi", np.nan)))
+
+def gain_vs_hv_figure(volts, gain, gainErr, pars, saveStr):
+    """Gain vs. HV with the power law fit (if pars isn't None), as a
+    plot_render figure
+    """
+    series = [{"x" : volts, "y" : gain, "yerr" : gainErr, "marker" : 'x', "linestyle" : ''}]
+    if pars is not None:
+        fit_v = np.linspace(min(volts), max(volts), 200)
+        series.append({"x" : fit_v, "y" : power_law(fit_v, *pars), "fmt" : '-', "color" : 'c',
+                       "label" : "G = %.2e V$^{%.2f}$" % (pars[0], pars[1])})
+    return {"file" : saveStr, "series" : series,
+            "yscale" : "log", "title" : "Gain as a function of HV", "xlabel" : "Voltage (V)", "ylabel" : "Gain",
+            "legend" : "upper left" if pars is not None else None}
+
+###############
+# MAIN FUNCTION
+###############
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-p", dest="powerFile", help="Power meter file used for all voltages")
+    parser.add_option("-d", dest="dataDir", default="data", help="Directory holding scope_data_*V/")
+    parser.add_option("-c", dest="channel", type="int", default=5, help="TELLIE channel")
+    parser.add_option("-j", dest="workers", type="int", default=1,
+                      help="Voltages analysed (and plots drawn) concurrently")
+    parser.add_option("--clip-samples", dest="clipSamples", type="int", default=4,
+                      help="Samples at a trace's minimum before it counts as clipped")
+    parser.add_option("--max-clipped", dest="maxClipped", type="int", default=10,
+                      help="Clipped traces allowed before a width is saturated")
+    parser.add_option("--drop-last", dest="dropLast", type="int", default=2,
+                      help="Clean widths at the top of each scan left out of its final gain")
+    parser.add_option("--bootstrap", dest="nBoot", type="int", default=bootstrap.N_BOOT,
+                      help="Bootstrap replicas for the error on each final gain (0: none)")
+    parser.add_option("--seed", dest="seed", type="int", default=None, help="Random seed for the bootstrap")
+    parser.add_option("--no-plots", dest="plots", action="store_false", default=True,
+                      help="Skip the per-voltage plots")
+    parser.add_option("--replot", dest="replot", action="store_true", default=False,
+                      help="Redraw every plot, even if its data and style are unchanged")
+    parser.add_option("--no-cache", dest="cache", action="store_false", default=True,
+                      help="Re-parse and re-screen everything, ignoring the data cache")
+    (options,args) = parser.parse_args()
+    scriptTime = time.time()
+
+    scans = find_scans(options.dataDir, options.channel)
+    if len(scans) == 0:
+        raise IOError("No Chan%02d scans found under %s" % (options.channel, options.dataDir))
+    print "Found %i voltages" % len(scans)
+
+    # Read the power meter file once for all voltages
+    head, pm = pm_data.load_power_meter_file(options.powerFile, options.cache)
+
+    jobs = [(scan, head, pm, options.powerFile, options.clipSamples, options.maxClipped, options.cache,
+             options.dropLast, options.nBoot, options.seed) for scan in scans]
+    if options.workers > 1:
+        pool = multiprocessing.Pool(options.workers)
+        try:
+            results = pool.map(analyse, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [analyse(job) for job in jobs]
+
+    resultsDir = calibration.check_dir('results/')
+    figures = []
+    usable = []
+    for scan, res in zip(scans, results):
+        if not np.isfinite(res["final_gain"]):
+            print >> sys.stderr, "Skipping %1.2fV: no clean widths left for a gain" % res["voltage"]
+            continue
+        usable.append(res)
+        print "Gain at %1.1fV is: %.3e +/- %.3e" % (res["voltage"], res["final_gain"], res["final_gain_err"]),
+        if options.nBoot:
+            print "(bootstrap error %.3e, 95%% interval %.3e - %.3e)" % (res["boot_mean_err"], res["boot_mean_lo"],
+                                                                       res["boot_mean_hi"]),
+        print
+        if options.plots:
+            saveDir = calibration.check_dir('%s%s/' % (resultsDir, os.path.basename(scan)))
+            figures.extend(calibration.scan_figures(res, pm, saveDir))
+
+    volts = np.array([res["voltage"] for res in usable])
+    gain = np.array([res["final_gain"] for res in usable])
+    gainErr = np.array([res["final_gain_err"] for res in usable])
+    pars, cov = None, None
+    if len(usable) >= 2:
+        pars, cov = fit_power_law(volts, gain, gainErr)
+        print "Fit: G = %.3e * V^%.3f" % (pars[0], pars[1])
+    else:
+        print >> sys.stderr, "%i voltage(s) with a gain: no power law fit" % len(usable)
+
+    write_table("%sGainVsHV_Chan%02d.dat" % (resultsDir, options.channel), usable, pars, cov)
+    if len(usable):
+        figures.append(gain_vs_hv_figure(volts, gain, gainErr, pars,
+                                         "%sGainVsHV_Chan%02d.png" % (resultsDir, options.channel)))
+    # All plots, per voltage and vs. HV, are drawn together
+    drawn, skipped = plot_render.render(figures, options.workers, options.replot)
+    print "Drew %i plots, %i up to date" % (len(drawn), len(skipped))
+
+    print "Script took : \t{:1.2f} min".format( (time.time()-scriptTime)/60 )
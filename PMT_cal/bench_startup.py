@@ -0,0 +1,92 @@
+#############################################
+# Benchmark cold start of the analysis
+# scripts: each module is imported in a fresh
+# interpreter and the import time, and whether
+# ROOT or matplotlib came with it, is reported.
+# With -p/-s a full numbers-only run of
+# calibration.py --json is timed as well.
+#
+# Exits non-zero if a module pulls in a
+# plotting library or is slower than --max, so
+# it can be run as a check.
+#
+# python PMT_cal/bench_startup.py
+#############################################
+import optparse
+import subprocess
+import time
+import sys
+import os
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.dirname(HERE)
+MODULES = ("calibration", "live_gain", "batch_calibration", "features", "pe_fit", "piecewise_fit")
+HEAVY = ("ROOT", "matplotlib")
+
+IMPORT_TIMER = """
+import sys, time
+start = time.time()
+import %s
+print time.time() - start
+print ",".join(m for m in %r if m in sys.modules)
+"""
+
+
+def environment():
+    """Environment with the repo's script directories on the path"""
+    env = dict(os.environ)
+    paths = [HERE, os.path.join(TOP, "common"), os.path.join(TOP, "power_meter")]
+    if env.get("PYTHONPATH"):
+        paths.append(env["PYTHONPATH"])
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+    return env
+
+def time_import(module, env):
+    """(seconds, heavy modules loaded) for importing module in a new interpreter"""
+    out = subprocess.check_output([sys.executable, "-c", IMPORT_TIMER % (module, HEAVY)], env=env)
+    seconds, loaded = out.splitlines()[-2:]
+    return float(seconds), [m for m in loaded.split(",") if m]
+
+def time_run(args, env):
+    """Wall time of a command, output discarded"""
+    start = time.time()
+    with open(os.devnull, 'w') as null:
+        subprocess.check_call(args, env=env, stdout=null)
+    return time.time() - start
+
+
+###############
+# MAIN FUNCTION
+###############
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-n", dest="repeats", type="int", default=5, help="Cold starts per module")
+    parser.add_option("--max", dest="maxTime", type="float", default=1.,
+                      help="Fail if a module's median import takes longer than this (s)")
+    parser.add_option("-p", dest="powerFile", default=None, help="Power meter file for a calibration.py --json run")
+    parser.add_option("-s", dest="scopeFile", default=None, help="Scope scan file for a calibration.py --json run")
+    (options,args) = parser.parse_args()
+
+    env = environment()
+    failed = False
+    print "%-20s %10s %10s  %s" % ("module", "median (s)", "max (s)", "plotting imported")
+    for module in MODULES:
+        times, heavy = [], set()
+        for i in range(options.repeats):
+            seconds, loaded = time_import(module, env)
+            times.append(seconds)
+            heavy.update(loaded)
+        median = np.median(times)
+        slow = median > options.maxTime
+        failed |= slow or bool(heavy)
+        print "%-20s %10.3f %10.3f  %s%s" % (module, median, max(times), ",".join(sorted(heavy)) or "-",
+                                              "  SLOW" if slow else "")
+
+    if options.powerFile and options.scopeFile:
+        command = [sys.executable, os.path.join(HERE, "calibration.py"), "-p", options.powerFile,
+                   "-s", options.scopeFile, "--json", "-"]
+        times = [time_run(command, env) for i in range(options.repeats)]
+        print "calibration.py --json: median %1.3f s, max %1.3f s (with data cache)" % (np.median(times), max(times))
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,82 @@
+###################################################
+# Bootstrap uncertainties on the gain.
+#
+# All replicas are drawn at once as an
+# (n_boot, n_points) matrix of how many times each
+# point appears in each replica, so the weighted
+# mean and weighted straight line fit of every
+# replica are matrix products with the data and a
+# few thousand replicas cost about as much as one
+# curve_fit.
+#
+# Intervals are percentiles of the replicas.
+###################################################
+import numpy as np
+
+N_BOOT = 2000
+
+
+def resample(n_points, n_boot=N_BOOT, seed=None):
+    """(n_boot, n_points) counts of each point in each replica, every row
+    a sample of n_points with replacement
+    """
+    rng = np.random.RandomState(seed)
+    idx = rng.randint(0, n_points, size=(n_boot, n_points))
+    idx += n_points*np.arange(n_boot)[:, np.newaxis]
+    return np.bincount(idx.ravel(), minlength=n_boot*n_points).reshape(n_boot, n_points).astype(float)
+
+def weighted_means(values, weights, counts):
+    """Weighted mean of values for each replica"""
+    values, weights = np.asarray(values, dtype=float), np.asarray(weights, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return counts.dot(weights*values) / counts.dot(weights)
+
+def line_fits(x, y, sigma, counts):
+    """Weighted least squares y = a*x + b (weights 1/sigma^2) for each
+    replica, in closed form. Returns (a, b); nan where a replica has a
+    single distinct x.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    w = 1. / np.asarray(sigma, dtype=float)**2
+    # Centre on the full sample first so the sums don't cancel
+    x0, y0 = np.average(x, weights=w), np.average(y, weights=w)
+    dx, dy = x - x0, y - y0
+    sw, swx, swy, swxx, swxy = counts.dot(np.column_stack((w, w*dx, w*dy, w*dx*dx, w*dx*dy))).T
+    mx, my = swx / sw, swy / sw
+    sxx = swxx - sw*mx*mx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = np.where(sxx > 1e-12*swxx, (swxy - sw*mx*my) / sxx, np.nan)
+    return a, y0 + my - a*(x0 + mx)
+
+def interval(samples, alpha=0.05):
+    """Percentile interval (lo, hi) of the replicas, ignoring nan"""
+    lo, hi = np.nanpercentile(samples, [100*alpha/2., 100*(1-alpha/2.)])
+    return lo, hi
+
+KEYS = ("mean_err", "mean_lo", "mean_hi", "slope", "intercept", "slope_lo", "slope_hi",
+        "intercept_lo", "intercept_hi")
+
+
+def bootstrap_gain(photons, gain, gainErr, weights=None, n_boot=N_BOOT, alpha=0.05, seed=None):
+    """Bootstrap the mean gain and the straight line fit of gain vs. photons.
+    weights are those of the mean, default 1/gainErr^2 as for the line.
+    Returns a dict of the standard deviation and percentile interval of
+    the mean, and the line's slope and intercept with their intervals;
+    all NaN with fewer than 2 points.
+    """
+    gainErr = np.asarray(gainErr, dtype=float)
+    if weights is None:
+        weights = 1. / gainErr**2
+    if len(gain) < 2:
+        result = dict((key, np.nan) for key in KEYS)
+        result["n_boot"] = n_boot
+        return result
+    counts = resample(len(gain), n_boot, seed)
+    means = weighted_means(gain, weights, counts)
+    slopes, intercepts = line_fits(photons, gain, gainErr, counts)
+    result = {"n_boot" : n_boot, "mean_err" : np.nanstd(means)}
+    result["mean_lo"], result["mean_hi"] = interval(means, alpha)
+    result["slope"], result["intercept"] = np.nanmedian(slopes), np.nanmedian(intercepts)
+    result["slope_lo"], result["slope_hi"] = interval(slopes, alpha)
+    result["intercept_lo"], result["intercept_hi"] = interval(intercepts, alpha)
+    return result
@@ -6,6 +6,12 @@
 # Date: 23/10/2014
 ##################################################
 import calc_utils as calc
+import waveform_store
+import pm_data
+import data_cache
+import pmt_gain
+import plot_render
+import bootstrap
 import sys
 #import Analysis
 # Standard stuff
@@ -13,108 +19,146 @@ import optparse
 import time
 import math
 import os
+import re
+import multiprocessing
+import json
 import numpy as np
-import scipy.optimize
-import scipy.stats.distributions
-import matplotlib.pyplot as plt
-import matplotlib
-import ROOT
+# scipy and matplotlib (via plot_render) are imported where they're used, so
+# scripts that only want the numbers (--json, batch jobs, live_gain) don't pay for them
+
+SCAN_DTYPE = np.dtype([("ipw", np.int64), ("ipw_err", np.int64), ("pin", np.int64), ("pin_err", np.int64),
+                       ("width", np.float64), ("width_err", np.float64), ("rise", np.float64), ("rise_err", np.float64),
+                       ("fall", np.float64), ("fall_err", np.float64), ("area", np.float64), ("area_err", np.float64),
+                       ("mini", np.float64), ("mini_err", np.float64)])
 
 def read_scope_scan(fname):
     """Read data as read out and stored to text file from the scope.
     Columns are: ipw, pin, width, rise, fall, width (again), area.
     Rise and fall are opposite to the meaning we use (-ve pulse)
+    Returns a structured array with the fields in SCAN_DTYPE, read either by
+    column (data["area"]) or by row (data[i]["area"]).
     """
-    fin = file(fname,'r')
-    resultsList = []
-    for line in fin.readlines():
-        if line[0]=="#":
-            continue
-        bits = line.split()
-        if len(bits)!=14:
-            continue
-        resultsList.append({"ipw":int(bits[0]),"ipw_err": int(bits[1]),"pin":int(bits[2]),"pin_err":int(bits[3]),"width":float(bits[4]),"width_err":float(bits[5]),"rise":float(bits[6]),"rise_err":float(bits[7]),"fall":float(bits[8]),"fall_err":float(bits[9]),"area":float(bits[10]),"area_err":float(bits[11]),"mini":float(bits[12]),"mini_err":float(bits[13])})
-    return resultsList
+    with open(fname,'r') as fin:
+        text = re.sub(r"(?m)^#.*$", "", fin.read())
+    noCol = len(SCAN_DTYPE.names)
+    values = np.fromstring(text, sep=" ")
+    # fromstring stops quietly at the first bad value, so check every data
+    # line was read in full
+    lines = [line.split() for line in text.splitlines() if line.strip()]
+    if values.size != len(lines)*noCol:
+        # Malformed lines present: keep only the complete ones
+        values = np.array([bits for bits in lines if len(bits)==noCol], dtype=float)
+        if len(lines) > len(values):
+            print >> sys.stderr, "%s: left out %i incomplete line(s)" % (fname, len(lines) - len(values))
+    values = values.reshape(-1, noCol)
+    data = np.zeros(len(values), dtype=SCAN_DTYPE)
+    for i, name in enumerate(SCAN_DTYPE.names):
+        data[name] = values[:,i]
+    return data
 
-def read_pin_header(fileName):
-    '''Read header of power-meter data file'''
-    # Open file, read only the first line
-    with open(fileName, 'r') as file:
-        header = file.readline()
-    tmp = header.split(" ")
-    # Return as dict.
-    return {"Wavelength" : int(tmp[0]), "Pulse sep" : float(tmp[1]), "Rate" : int(tmp[2]), "Temp" : float(tmp[3]), "Pedestal" : float(tmp[4]) }
+def read_width(path, width):
+    '''Return the scope traces for a width, or None if there are none.
+    Reads from the channel's waveform store if there is one (as raw ADC codes
+    where the store holds them), falling back to the per-width pickle.
+    '''
+    if waveform_store.has_store(path):
+        store = waveform_store.open_store(path)
+        if width in store:
+            return store.read(width)
+    file = '%s/Width%05d.pkl' % (path, width)
+    if not os.path.isfile(file):
+        return None
+    x, y = calc.readPickleChannel(file, 1)
+    return y
 
-def read_pin_data(fileName):
-    '''Read power-meter data'''
-    # Find no. of lines
-    noLin = sum(1 for line in open(fileName)) - 1  ###-1 to correct for header    
-    # Define new arrays
-    widths, PIN, PINErr = np.zeros(noLin), np.zeros(noLin), np.zeros(noLin)
-    photons, photonErr = np.zeros(noLin), np.zeros(noLin)
-    watts, wattsErr = np.zeros(noLin), np.zeros(noLin)
-    # Open file
-    c = 0
-    with open(fileName, 'r') as file:
-        next(file)
-        for line in file:
-            tmp = line.split(" ")
-            widths[c] = int(tmp[0])
-            PIN[c] = int(tmp[1])
-            #PINErr[c] = int(tmp[2])
-            photons[c] = int(tmp[2])
-            photonErr[c] = int(tmp[3])
-            watts[c] = float(tmp[4])
-            wattsErr[c] = float(tmp[5])
-            c=c+1
-    # return filled lists
-    return widths, PIN, PINErr, watts, wattsErr
+def screen_width(args):
+    '''Load one width's raw data and check it for saturation.
+    Takes a single (path, width, clip_samples, max_clipped) tuple so it can be
+    mapped over a process pool. Returns None if there is no raw data for the
+    width.
+    '''
+    path, width, clip_samples, max_clipped = args
+    y = read_width(path, width)
+    if y is None:
+        return None
+    return check_saturation(y, clip_samples, max_clipped)
 
-def get_clean_data_points(widths, gain, path):
-    '''Check all data points for saturation or 0 result.'''
+def get_clean_data_points(widths, gain, path, clip_samples=4, max_clipped=10, workers=1):
+    '''Check all data points for saturation or 0 result.
+    Returns the list of clean indices and the saturated fraction of traces at
+    each width (nan where no raw data was found, or the gain is nan because
+    the width wasn't scanned). With workers > 1 the raw
+    files are loaded and screened in a process pool; results are identical
+    to the serial path and come back in width order.
+    '''
+    scanned = np.flatnonzero(np.isfinite(gain))
+    jobs = [(path, int(widths[i]), clip_samples, max_clipped) for i in scanned]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(screen_width, jobs, chunksize=max(1, len(jobs) // (4*workers)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = []
+        for i, job in enumerate(jobs):
+            results.append(screen_width(job))
+            print i, len(jobs)
     index = []
-    for i, g in enumerate(gain):
-        file = '%s/Width%05d.pkl' % (path, widths[i])
-        if os.path.isfile(file):
-            x, y = calc.readPickleChannel(file, 1)
-            print i, len(widths)
-            if check_saturation(y) is False and gain[i] > 0:
-                index.append(i)
-    return index
-
-def check_saturation(y):
-    '''Check if data set is saturated'''
-    counter = 0
-    for i in range(len(y[:,1])):
-        idx = np.where(y[i,:] == min(y[i,:]))[0]
-        if len(idx) > 4:
-            counter = counter + 1
-        if counter > 10:
-            return True
-    return False
+    sat_frac = np.zeros(len(gain))*np.nan
+    for i, result in zip(scanned, results):
+        if result is None:
+            continue
+        saturated, sat_frac[i] = result
+        if not saturated and gain[i] > 0:
+            index.append(i)
+    return index, sat_frac
 
-def scaling(rawArr, rawErr, header):
-    # New arrays
-    scaledArr, scaledErr = np.zeros( len(rawArr) ), np.zeros( len(rawArr) )
+def check_saturation(y, clip_samples=4, max_clipped=10):
+    '''Check if data set is saturated.
+    A trace is clipped if more than clip_samples of its samples sit at the
+    trace minimum; the set is saturated if more than max_clipped traces are
+    clipped. All traces in the 2D array y are screened in one pass, and y can
+    be raw ADC codes as well as volts.
+    Returns (saturated, fraction of traces clipped).
+    '''
+    y = np.atleast_2d(y)
+    if y.size == 0:
+        return False, 0.
+    at_min = np.sum(y == y.min(axis=1)[:,np.newaxis], axis=1)
+    n_clipped = np.count_nonzero(at_min > clip_samples)
+    return n_clipped > max_clipped, float(n_clipped) / len(y)
 
-    # Calculate photon energy (J)
-    ePh = (6.626e-34 * 3e8) / (header["Wavelength"]*1e-9)
-    
-    for i, val in enumerate(rawArr):
-        # Calculate no of photons
-        scaledArr[i] = (rawArr[i]*header["Pulse sep"]) / ePh
-        scaledErr[i] = (rawErr[i]*header["Pulse sep"]) / ePh
-    return scaledArr, scaledErr
+def match_widths(scan_widths, pm_widths):
+    '''Pair the rows of a scope scan with those of the power meter file by
+    width. Widths in only one of the files are reported and left out; a width
+    repeated in either file is an error.
+    Returns (scan row index, power meter row index) of the common widths.
+    '''
+    scan_widths, pm_widths = np.asarray(scan_widths, dtype=int), np.asarray(pm_widths, dtype=int)
+    for name, widths in (("scope scan", scan_widths), ("power meter file", pm_widths)):
+        values, counts = np.unique(widths, return_counts=True)
+        if np.any(counts > 1):
+            raise ValueError("Widths repeated in %s: %s" % (name, values[counts > 1].tolist()))
+    common, scan_idx, pm_idx = np.intersect1d(scan_widths, pm_widths, assume_unique=True, return_indices=True)
+    only_scan = np.setdiff1d(scan_widths, common)
+    only_pm = np.setdiff1d(pm_widths, common)
+    if len(only_scan):
+        print >> sys.stderr, "Warning: widths not in the power meter file, left out:", only_scan.tolist()
+    if len(only_pm):
+        print >> sys.stderr, "Warning: widths not in the scope scan, left out:", only_pm.tolist()
+    return scan_idx, pm_idx
 
-def calcGain(data_list, noPhotons, noPhotonsErr):
-    gain, gainErr = np.zeros(len(data_list)), np.zeros(len(data_list))
-    for i in range(len(data_list)):
-        if data_list[i]["area"] != 0:
-            gain[i] = np.abs(data_list[i]["area"]) / (noPhotons[i]*1.6e-19)
-            gainErr[i] = np.abs(gain[i])*np.sqrt( (data_list[i]["area_err"]/data_list[i]["area"])**2 + (noPhotonsErr[i]/noPhotons[i])**2 )
-        else:
-            gain[i], gainErr[i] = 0, 0
-    return gain, gainErr
+def calcGain(data_list, pm_widths, noPhotons, noPhotonsErr):
+    '''Gain at each width of the power meter file, NaN where the scope scan
+    has no row for the width
+    '''
+    scan_idx, pm_idx = match_widths(data_list["ipw"], pm_widths)
+    g, gErr = np.nan*np.ones(len(pm_widths)), np.nan*np.ones(len(pm_widths))
+    g[pm_idx], gErr[pm_idx] = pmt_gain.calc_gain(data_list["area"][scan_idx], data_list["area_err"][scan_idx],
+                                                 noPhotons[pm_idx], noPhotonsErr[pm_idx])
+    return g, gErr
 
 def check_dir(dname):
     """Check if directory exists, create it if it doesn't"""
@@ -134,10 +178,7 @@ def line_func(x, a, b):
 
 def build_fitted_arrays(x_arr, a, b):
     '''Make y array using fitted parameters'''
-    y = np.zeros(len(x_arr))
-    for i, x in enumerate(x_arr):
-        y[i] = line_func(x, a, b)
-    return y
+    return line_func(np.asarray(x_arr, dtype=float), a, b)
 
 def fit_standard_errors(pars, cov, noPoints):
     '''Calc standard errors on fitted parameters'''
@@ -148,6 +189,7 @@ def fit_standard_errors(pars, cov, noPoints):
 
 def conf_intervals(pars, cov, noPoints, alpha=0.05):
     '''Calc confidence interval for fitted parameters'''
+    import scipy.stats.distributions
     # No. of degrees of freedom
     dof = max(0, noPoints - len(pars))
     # Student-t value for the dof and conf. level
@@ -169,49 +211,80 @@ def weighted_avg_and_std(values, weights):
     variance = np.average((values-average)**2, weights=weights)  # Fast and numerically precise
     return (average, np.sqrt(variance))
 
-###############
-# MAIN FUNCTION
-###############
-if __name__ == "__main__":
-    parser = optparse.OptionParser()
-    parser.add_option("-p", dest="powerFile")
-    parser.add_option("-s", dest="scopeFile")
-    (options,args) = parser.parse_args()
-    scriptTime = time.time()
+def scan_voltage(scopeFile):
+    '''Voltage of a Chan%02d_%1.2fV.dat scope scan, taken from its name'''
+    match = re.search(r"_([0-9.]+)V\.dat$", os.path.basename(scopeFile))
+    if match is None:
+        match = re.search(r"scope_data_([0-9.]+)V", scopeFile)
+    return float(match.group(1))
 
-    # ROOT stuff
-    ROOT.gEnv.SetValue('Canvas.SavePrecision', "16")
-    tc = ROOT.TCanvas("c1","c1",800,600)
+def scan_channel(scopeFile, default=5):
+    '''TELLIE channel of a Chan%02d_%1.2fV.dat scope scan'''
+    match = re.match(r"Chan(\d+)_", os.path.basename(scopeFile))
+    return int(match.group(1)) if match else default
 
-    # Read in power_meter data file
-    head = read_pin_header(options.powerFile)
-    wi, PIN, PINErr, watts, wattsErr = read_pin_data(options.powerFile)
-    ph, phErr = scaling(watts, wattsErr, head)
+def analyse_scan(scopeFile, head, pm, powerFile, clip_samples=4, max_clipped=10, workers=1, use_cache=True,
+                 drop_last=2, n_boot=0, seed=None):
+    '''Calculate the gain at each width of one scope scan, screen out
+    saturated and zero points and average what is left, leaving out the
+    last drop_last points. With no points left the final gain is NaN.
+    head and pm are the parsed power-meter file, so one read can be shared
+    between many scans. Returns a dict of the clean arrays and final gain;
+    with n_boot replicas it also holds the bootstrap error and 95% interval
+    on the final gain (boot_*) and a bootstrapped gain vs. photons line.
+    '''
+    wi, PIN, PINErr, watts, wattsErr = pm["width"], pm["pin"], pm["pin_rms"], pm["watts"], pm["watt_err"]
+    ph, phErr = pmt_gain.scaling(watts, wattsErr, head)
 
     # Read in PMT-scope data file
-    pmt_data = read_scope_scan(options.scopeFile)
-    g, gErr = calcGain(pmt_data, ph, phErr)
-    
+    pmt_data = data_cache.cached("scope_scan", [scopeFile], {"dtype" : SCAN_DTYPE.descr},
+                                 lambda: {"scan" : read_scope_scan(scopeFile)},
+                                 enabled=use_cache)["scan"]
+    g, gErr = calcGain(pmt_data, wi, ph, phErr)
+
     # Take out bad (zero) data points
-    p =  options.scopeFile.split('/')
-    tmpStr = ''
-    for it, direc in enumerate(p):
-        if it < len(p)-1:
-            tmpStr = tmpStr + '/%s' % direc
-    idx = get_clean_data_points(wi, g, ".%s/raw_data/Channel_05/" % (tmpStr))
-    print idx
-    photons, photonsErr = ph[idx], phErr[idx]
-    gain, gainErr = g[idx], gErr[idx]
-    widths, pin, pinErr = wi[idx], PIN[idx], PINErr[idx]
+    rawDir = os.path.join(os.path.dirname(scopeFile), "raw_data", "Channel_%02d" % scan_channel(scopeFile))
+    def screen():
+        idx, sat_frac = get_clean_data_points(wi, g, rawDir, clip_samples, max_clipped, workers)
+        return {"index" : np.array(idx, dtype=int), "sat_frac" : sat_frac}
+    clean = data_cache.cached("clean_points", [powerFile, scopeFile, rawDir],
+                              {"clip_samples" : clip_samples, "max_clipped" : max_clipped},
+                              screen, enabled=use_cache)
+    idx = clean["index"]
+    result = {"voltage" : scan_voltage(scopeFile), "index" : idx, "sat_frac" : clean["sat_frac"],
+              "photons" : ph[idx], "photonsErr" : phErr[idx], "gain" : g[idx], "gainErr" : gErr[idx],
+              "widths" : wi[idx], "pin" : PIN[idx], "pinErr" : PINErr[idx], "drop_last" : drop_last}
+    used = slice(0, max(len(idx) - drop_last, 0))
+    if len(idx) > drop_last:
+        result["final_gain"], result["final_gain_err"] = weighted_avg_and_std(result["gain"][used],
+                                                                              1. / result["gainErr"][used]**2)
+    else:
+        print >> sys.stderr, "%s: %i clean widths, none left after dropping the last %i; no final gain" % (
+            scopeFile, len(idx), drop_last)
+        result["final_gain"], result["final_gain_err"] = np.nan, np.nan
+    if n_boot:
+        boot = bootstrap.bootstrap_gain(result["photons"][used], result["gain"][used], result["gainErr"][used],
+                                        n_boot=n_boot, seed=seed)
+        for key, value in boot.items():
+            result["boot_" + key] = value
+    return result
+
+def scan_summary(result):
+    '''The numbers from analyse_scan as plain lists and floats, for json'''
+    summary = {}
+    for key, value in result.items():
+        summary[key] = value.tolist() if isinstance(value, np.ndarray) else float(value)
+    return summary
+
+def scan_figures(result, pm, saveDir):
+    '''The standard plots for an analysed scan, as plot_render figures'''
+    used = slice(0, max(len(result["gain"]) - int(result.get("drop_last", 2)), 0))
+    photons, photonsErr = result["photons"], result["photonsErr"]
+    gain, gainErr = result["gain"], result["gainErr"]
+    widths, pin = result["widths"], result["pin"]
+    final_gain, final_gain_err = result["final_gain"], result["final_gain_err"]
+    wi, PIN, PINErr = pm["width"], pm["pin"], pm["pin_rms"]
 
-    ######### PLOT RESULTS ##########
-    check_dir('results/%s/' % p[-1])
-    voltage = get_num_from_str(p[-2])
-    final_gain, final_gain_err = weighted_avg_and_std(gain[:-2], gainErr[:-2])
-    print ######################################
-    print "\nGain at %1.1fV is: %.3e +/- %.3e\n" % (voltage, final_gain, final_gain_err)
-    print ######################################
-    
     ### Fit stuff - doesn't always hold
     #initial_guess = [-1e-1, 1e5]
     #pars, cov = scipy.optimize.curve_fit(line_func, photons[:-2], gain[:-2], p0=initial_guess, sigma=gainErr[:-2], absolute_sigma=True)
@@ -221,49 +294,90 @@ if __name__ == "__main__":
     #fit_lo = build_fitted_arrays(fit_x, intervals[0,0], intervals[1,0])
     #fit_hi = build_fitted_arrays(fit_x, intervals[0,1], intervals[1,1])
 
-    matplotlib.rcParams.update({'font.size': 18})
-    plt.figure(num=1, figsize=(10, 8), dpi=80, facecolor='w')
-    ax = plt.errorbar(photons[:-2], gain[:-2], gainErr[:-2], fmt = '', marker='x')
-    #ax1 = plt.plot(fit_x, fit_y,'-',color='c')
-    #ax.fill_between(fit_x, fit_lo, fit_hi, facecolor='yellow', alpha=0.5, label='Cl 95%') #Doens't work for errobar
-    #ax2 = plt.plot(fit_x, fit_lo,'--',color='c')
-    #ax3 = plt.plot(fit_x, fit_hi,'--',color='c', label='Cl 95%')
-    plt.title("Gain as a function of photons")
-    plt.xlabel("No. Photons")
-    plt.ylabel("Gain")
-    text_str = "           Gain:\nmean = %.3e\nsigma = %.3e" % (final_gain, final_gain_err)
-    axis = plt.gca()
-    props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
-    axis.text(0.65, 0.95, text_str, transform=axis.transAxes, fontsize=14,verticalalignment='top', bbox=props)
-    saveStr = 'results/%s/GainVsPhotons.png' % p[-1]
-    plt.savefig(saveStr, dpi=100)
+    gainSeries = [{"x" : photons[used], "y" : gain[used], "yerr" : gainErr[used], "marker" : 'x'}]
+    text = "           Gain:\nmean = %.3e\nsigma = %.3e" % (final_gain, final_gain_err)
+    if "boot_mean_err" in result and len(photons):
+        fit_x = np.array([0, max(photons)], dtype=float)
+        gainSeries.append({"x" : fit_x, "y" : result["boot_slope"]*fit_x + result["boot_intercept"],
+                           "fmt" : '-', "color" : 'c'})
+        text += "\nboot. error = %.3e" % result["boot_mean_err"]
+    return [{"file" : '%s/GainVsPhotons.png' % saveDir, "series" : gainSeries,
+             "title" : "Gain as a function of photons", "xlabel" : "No. Photons", "ylabel" : "Gain",
+             "text" : text},
+            {"file" : '%s/GainVsIPW.png' % saveDir,
+             "series" : [{"x" : widths, "y" : gain, "yerr" : gainErr, "marker" : 'x'}],
+             "title" : "Gain as a function of IPW", "xlabel" : "IPW (14 bit)", "ylabel" : "Gain"},
+            {"file" : '%s/PINVsPhotons.png' % saveDir,
+             "series" : [{"x" : pin[used], "y" : photons[used], "yerr" : photonsErr[used], "marker" : 'x'}],
+             "title" : "PIN reading as a function of photons", "xlabel" : "PIN (16 bit)", "ylabel" : "No. photons"},
+            {"file" : '%s/IPWVsPIN.png' % saveDir,
+             "series" : [{"x" : wi, "y" : PIN, "yerr" : PINErr, "marker" : 'x'}],
+             "title" : "IPW as a function of PIN readout", "xlabel" : "IPW (14 bit)", "ylabel" : "PIN (16 bit)"}]
+
+def plot_scan(result, pm, saveDir, workers=1, force=False):
+    '''Make the standard plots for an analysed scan in saveDir, skipping
+    any that are up to date. Returns (files drawn, files skipped).
+    '''
+    return plot_render.render(scan_figures(result, pm, saveDir), workers, force)
+
+###############
+# MAIN FUNCTION
+###############
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-p", dest="powerFile")
+    parser.add_option("-s", dest="scopeFile")
+    parser.add_option("--clip-samples", dest="clipSamples", type="int", default=4,
+                      help="Samples at a trace's minimum before it counts as clipped")
+    parser.add_option("--max-clipped", dest="maxClipped", type="int", default=10,
+                      help="Clipped traces allowed before a width is saturated")
+    parser.add_option("-j", dest="workers", type="int", default=1,
+                      help="Worker processes for loading and screening raw data")
+    parser.add_option("--no-cache", dest="cache", action="store_false", default=True,
+                      help="Re-parse and re-screen everything, ignoring the data cache")
+    parser.add_option("--drop-last", dest="dropLast", type="int", default=2,
+                      help="Clean widths at the top of the scan left out of the final gain")
+    parser.add_option("--bootstrap", dest="nBoot", type="int", default=0,
+                      help="Bootstrap replicas for the error on the final gain (0: none)")
+    parser.add_option("--seed", dest="seed", type="int", default=None, help="Random seed for the bootstrap")
+    parser.add_option("--replot", dest="replot", action="store_true", default=False,
+                      help="Redraw every plot, even if its data and style are unchanged")
+    parser.add_option("--json", dest="jsonFile", default=None,
+                      help="Numbers only: write the results as json to this file ('-' for stdout), no plots")
+    (options,args) = parser.parse_args()
+    scriptTime = time.time()
 
-    plt.figure(num=2, figsize=(10, 8), dpi=80, facecolor='w')
-    ax = plt.errorbar(widths, gain, gainErr, fmt = '', marker='x')
-    plt.title("Gain as a function of IPW")
-    plt.xlabel("IPW (14 bit)")
-    plt.ylabel("Gain")
-    #plt.show()                                                                                                                         
-    saveStr = 'results/%s/GainVsIPW.png' % p[-1]
-    plt.savefig(saveStr, dpi=100)
+    # Read in power_meter data file
+    head, pm = pm_data.load_power_meter_file(options.powerFile, options.cache)
 
-    plt.figure(num=3, figsize=(10, 8), dpi=80, facecolor='w')
-    ax = plt.errorbar(pin[:-2], photons[:-2], photonsErr[:-2], fmt = '', marker='x')
-    plt.title("PIN reading as a function of photons")
-    plt.xlabel("PIN (16 bit)")
-    plt.ylabel("No. photons")
-    plt.legend()
-    saveStr = 'results/%s/PINVsPhotons.png' % p[-1]
-    plt.savefig(saveStr, dpi=100)
+    result = analyse_scan(options.scopeFile, head, pm, options.powerFile, options.clipSamples,
+                          options.maxClipped, options.workers, options.cache, options.dropLast,
+                          options.nBoot, options.seed)
+    if options.jsonFile:
+        summary = scan_summary(result)
+        summary["scope_file"], summary["power_file"] = options.scopeFile, options.powerFile
+        if options.jsonFile == "-":
+            json.dump(summary, sys.stdout, sort_keys=True)
+            print
+        else:
+            with open(options.jsonFile, 'w') as json_file:
+                json.dump(summary, json_file, sort_keys=True, indent=1)
+        sys.exit(0)
+    print result["index"]
+    print "Saturated fraction per width:", result["sat_frac"]
 
-    plt.figure(num=4, figsize=(10, 8), dpi=80, facecolor='w')
-    ax = plt.errorbar(wi, PIN, PINErr, fmt='', marker='x')
-    plt.title("IPW as a function of PIN readout")
-    plt.xlabel("IPW (14 bit)")
-    plt.ylabel("PIN (16 bit)")
-    plt.legend()
-    saveStr = 'results/%s/IPWVsPIN.png' % p[-1]
-    plt.savefig(saveStr, dpi=100)
-    #plt.show()
+    ######### PLOT RESULTS ##########
+    saveDir = check_dir('results/%s/' % os.path.basename(options.scopeFile))
+    print ######################################
+    print "\nGain at %1.1fV is: %.3e +/- %.3e\n" % (result["voltage"], result["final_gain"], result["final_gain_err"])
+    if options.nBoot:
+        print "Bootstrap (%i): error on mean %.3e, 95%% interval %.3e - %.3e" % (options.nBoot, result["boot_mean_err"],
+                                                                          result["boot_mean_lo"], result["boot_mean_hi"])
+        print "Gain vs. photons: slope %.3e (%.3e - %.3e), intercept %.3e (%.3e - %.3e)\n" % (
+            result["boot_slope"], result["boot_slope_lo"], result["boot_slope_hi"],
+            result["boot_intercept"], result["boot_intercept_lo"], result["boot_intercept_hi"])
+    print ######################################
+    drawn, skipped = plot_scan(result, pm, saveDir, options.workers, options.replot)
+    print "Drew %i plots, %i up to date" % (len(drawn), len(skipped))
 
     print "Script took : \t{:1.2f} min".format( (time.time()-scriptTime)/60 )
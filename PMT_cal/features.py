@@ -0,0 +1,222 @@
+###################################################
+# Recompute pulse features from the stored raw
+# waveforms instead of the scope's own measurements:
+# baseline subtraction, area over an integration
+# window, peak, 10-90% edges and FWHM, for every
+# trace of a width at once. Traces are processed in
+# chunks so memory use doesn't grow with the number
+# of traces.
+#
+# Writes a scope scan file (same columns as
+# sweep_and_acquire.py, readable by read_scope_scan)
+# so the analysis runs unchanged on the new numbers.
+#
+# python PMT_cal/features.py -s data/scope_data_1.00V/Chan05_1.00V.dat
+###################################################
+import os
+import re
+import time
+import optparse
+import multiprocessing
+import numpy as np
+import calc_utils as calc
+import waveform_store
+
+FEATURES = ("area", "peak", "rise", "fall", "width")
+CHUNK_TRACES = 65536
+SCAN_HEADER = "#PWIDTH\tPWIDTH Error\tPIN\tPIN Error\tWIDTH\tWIDTH Error\tRISE\tRISE Error\tFALL\t\
+FALL Error\tAREA\tAREA Error\tMinimum\tMinimum Error\n"
+
+
+def leading_crossing(p, peak_idx, level):
+    """Time (in samples) each trace first rises through level before its peak.
+    p is the baseline subtracted, positive going pulse; NaN if never below level.
+    """
+    n_samples = p.shape[1]
+    rows = np.arange(len(p))
+    samples = np.arange(n_samples)
+    before = np.where((p < level[:,np.newaxis]) & (samples < peak_idx[:,np.newaxis]), samples, -1).max(axis=1)
+    ok = before >= 0
+    i = np.where(ok, before, 0)
+    p0, p1 = p[rows, i], p[rows, np.minimum(i+1, n_samples-1)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = i + (level - p0) / (p1 - p0)
+    return np.where(ok, t, np.nan)
+
+def trailing_crossing(p, peak_idx, level):
+    """Time (in samples) each trace falls back through level after its peak"""
+    n_samples = p.shape[1]
+    rows = np.arange(len(p))
+    samples = np.arange(n_samples)
+    after = np.where((p < level[:,np.newaxis]) & (samples > peak_idx[:,np.newaxis]), samples, n_samples).min(axis=1)
+    ok = after < n_samples
+    j = np.where(ok, after, 1)
+    p0, p1 = p[rows, j-1], p[rows, j]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (j - 1) + (p0 - level) / (p0 - p1)
+    return np.where(ok, t, np.nan)
+
+def charge(y, x_incr, baseline=20, window=None, termination=50.):
+    """Charge (C, positive for negative going pulses) of every trace in a 2D
+    array, integrated over window after subtracting the baseline
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    first, last = (0, y.shape[1]) if window is None else window
+    base = y[:, :baseline].mean(axis=1)
+    return ((last - first)*base - y[:, first:last].sum(axis=1))*x_incr / termination
+
+def extract(y, x_incr, baseline=20, window=None, termination=50.):
+    """Features of every trace in a 2D array of negative going pulses (V).
+
+    baseline    -- number of leading samples averaged for the baseline
+    window      -- (first, last) sample of the integration window, default all
+    termination -- load the charge is calculated for (Ohm)
+
+    Returns a dict of per-trace arrays: area (C, positive), peak (V, the
+    baseline subtracted minimum), and in seconds: fall (leading edge, 10-90%),
+    rise (trailing edge, 90-10%) and width (FWHM). Rise and fall follow the
+    scope's naming, which is opposite to ours for a negative pulse.
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    p = y[:, :baseline].mean(axis=1)[:,np.newaxis] - y
+    rows = np.arange(len(p))
+    peak_idx = p.argmax(axis=1)
+    amp = p[rows, peak_idx]
+    t = {}
+    for frac in (0.1, 0.5, 0.9):
+        level = frac*amp
+        t["lead", frac] = leading_crossing(p, peak_idx, level)
+        t["trail", frac] = trailing_crossing(p, peak_idx, level)
+    return {"area" : charge(y, x_incr, baseline, window, termination),
+            "peak" : -amp,
+            "fall" : (t["lead", 0.9] - t["lead", 0.1])*x_incr,
+            "rise" : (t["trail", 0.1] - t["trail", 0.9])*x_incr,
+            "width" : (t["trail", 0.5] - t["lead", 0.5])*x_incr}
+
+
+class FeatureSums(object):
+    """Sums for the mean and error on the mean of each feature over chunks"""
+
+    def __init__(self):
+        self.n = dict((f, 0) for f in FEATURES)
+        self.sum = dict((f, 0.) for f in FEATURES)
+        self.sum2 = dict((f, 0.) for f in FEATURES)
+
+    def add(self, features):
+        for f in FEATURES:
+            values = features[f][np.isfinite(features[f])]
+            self.n[f] += len(values)
+            self.sum[f] += values.sum()
+            self.sum2[f] += np.dot(values, values)
+
+    def results(self):
+        """Means and errors, in the format of the dict returned by sweep.sweep"""
+        results = {}
+        for f in FEATURES:
+            n = self.n[f]
+            mean = self.sum[f] / n if n else 0.
+            var = max(self.sum2[f] / n - mean**2, 0.) if n else 0.
+            results[f] = mean
+            results[f+" error"] = np.sqrt(var / n) if n else 0.
+        return results
+
+def summarise(features):
+    """Mean and error on the mean of per-trace features from one array"""
+    sums = FeatureSums()
+    sums.add(features)
+    return sums.results()
+
+
+def iter_chunks(rawDir, width, chunk=CHUNK_TRACES):
+    """Yield (traces in volts, x_incr) for a width, chunk traces at a time,
+    from the waveform store or the width's pickle.
+    """
+    if waveform_store.has_store(rawDir):
+        store = waveform_store.open_store(rawDir)
+        if width in store:
+            entry = store.index[int(width)]
+            for start in range(0, entry["n_traces"], chunk):
+                yield store.read(width, slice(start, start+chunk), volts=True), entry["x_incr"]
+            return
+    fileName = '%s/Width%05d.pkl' % (rawDir, width)
+    if os.path.isfile(fileName):
+        x, y = calc.readPickleChannel(fileName, 1)
+        x_incr = waveform_store.x_axis_params(x)[1]
+        y = np.atleast_2d(y)
+        for start in range(0, len(y), chunk):
+            yield y[start:start+chunk], x_incr
+
+def analyse_width(args):
+    """Features of one width's traces; takes a single (rawDir, width, chunk,
+    baseline, window) tuple so it can be mapped over a process pool.
+    Returns None if there is no raw data for the width.
+    """
+    rawDir, width, chunk, baseline, window = args
+    sums, found = FeatureSums(), False
+    for y, x_incr in iter_chunks(rawDir, width, chunk):
+        sums.add(extract(y, x_incr, baseline, window))
+        found = True
+    return sums.results() if found else None
+
+def write_scan(fileName, widths, pins, results):
+    """Write features as a scope scan file"""
+    with open(fileName, 'w') as output_file:
+        output_file.write(SCAN_HEADER)
+        for width, pin, r in zip(widths, pins, results):
+            output_file.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n"%(width, 0, pin, 0,
+                                                r["width"], r["width error"],
+                                                r["rise"], r["rise error"],
+                                                r["fall"], r["fall error"],
+                                                r["area"], r["area error"],
+                                                r["peak"], r["peak error"] ))
+
+def process_scan(rawDir, widths, chunk=CHUNK_TRACES, baseline=20, window=None, workers=1):
+    """analyse_width over many widths, in a process pool if workers > 1.
+    Results come back in width order.
+    """
+    jobs = [(rawDir, int(w), chunk, baseline, window) for w in widths]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            return pool.map(analyse_width, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return [analyse_width(job) for job in jobs]
+
+
+###############
+# MAIN FUNCTION
+###############
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-s", dest="scopeFile", help="Scope scan file; its widths and PIN readings are kept")
+    parser.add_option("-o", dest="outFile", default=None,
+                      help="Output scan file (default: <scan file>_features.dat)")
+    parser.add_option("--baseline", dest="baseline", type="int", default=20,
+                      help="Leading samples averaged for the baseline")
+    parser.add_option("--window", dest="window", default=None,
+                      help="Integration window as first:last sample (default: whole trace)")
+    parser.add_option("--chunk", dest="chunk", type="int", default=CHUNK_TRACES,
+                      help="Traces processed at a time")
+    parser.add_option("-j", dest="workers", type="int", default=1,
+                      help="Worker processes (one width each)")
+    (options,args) = parser.parse_args()
+    scriptTime = time.time()
+
+    # Only the command line needs the analysis code
+    import calibration
+    rawDir = os.path.join(os.path.dirname(options.scopeFile), "raw_data",
+                          "Channel_%02d" % calibration.scan_channel(options.scopeFile))
+    scan = calibration.read_scope_scan(options.scopeFile)
+    window = None
+    if options.window:
+        window = tuple(int(b) for b in options.window.split(":"))
+    results = process_scan(rawDir, scan["ipw"], options.chunk, options.baseline, window, options.workers)
+    keep = [i for i, r in enumerate(results) if r is not None]
+    if len(keep) < len(results):
+        print "No raw data for widths:", [int(scan["ipw"][i]) for i in range(len(results)) if results[i] is None]
+
+    outFile = options.outFile or re.sub(r"\.dat$", "", options.scopeFile) + "_features.dat"
+    write_scan(outFile, scan["ipw"][keep], scan["pin"][keep], [results[i] for i in keep])
+    print "Wrote %s (%i widths) in %1.1f s" % (outFile, len(keep), time.time()-scriptTime)
@@ -0,0 +1,202 @@
+###################################################
+# Live gain while a scope sweep is running.
+#
+# Follows the Chan%02d_%1.2fV.dat file written by
+# sweep_and_acquire.py (or is called from its sweep
+# loop with --live) and, for each new width, works
+# out the gain and saturation and updates a running
+# weighted mean gain in constant time, so a bad run
+# shows up after a few widths rather than at the end.
+#
+# python PMT_cal/live_gain.py -p <power meter file> -s <scope scan file>
+###################################################
+import os
+import time
+import optparse
+import collections
+import numpy as np
+import pm_data
+import pmt_gain
+import calibration
+
+
+class RunningWeightedMean(object):
+    """Weighted mean and standard deviation updated one value at a time,
+    equal to calibration.weighted_avg_and_std over the same values/weights
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sum_w = 0.
+        self.mean = 0.
+        self.s = 0.
+
+    def add(self, value, weight):
+        if weight <= 0:
+            return
+        self.n += 1
+        self.sum_w += weight
+        delta = value - self.mean
+        self.mean += delta*weight / self.sum_w
+        self.s += weight*delta*(value - self.mean)
+
+    def result(self):
+        """(average, std), nan until there is a value"""
+        if self.sum_w == 0:
+            return np.nan, np.nan
+        return self.mean, np.sqrt(max(self.s, 0.) / self.sum_w)
+
+
+class LiveGain(object):
+    """Per width gain, saturation and running gain of a scan in progress.
+
+    As in calibration.analyse_scan a width is clean if its raw traces were
+    found, are not saturated and give a non-zero gain, and the final gain
+    leaves out the last drop_last clean widths. Those are held back here
+    until later widths arrive, so at the end of the sweep the running mean
+    is the same number calibration.py would give.
+    """
+
+    def __init__(self, head, pm, rawDir, clip_samples=4, max_clipped=10, drop_last=2):
+        self.rawDir = rawDir
+        self.clip_samples = clip_samples
+        self.max_clipped = max_clipped
+        ph, phErr = pmt_gain.scaling(pm["watts"], pm["watt_err"], head)
+        self.photons = dict((int(w), (p, e)) for w, p, e in zip(pm["width"], ph, phErr))
+        self.pending = collections.deque(maxlen=drop_last+1) if drop_last else None
+        self.mean = RunningWeightedMean()
+        self.widths = 0
+        self.saturated = 0
+
+    def add(self, width, area, area_err, y=None):
+        """Process one width. y are its traces, or None to load them from
+        rawDir. Returns a dict of the results for the width.
+        """
+        width = int(width)
+        self.widths += 1
+        result = {"width" : width, "gain" : np.nan, "gain_err" : np.nan, "sat_frac" : np.nan,
+                  "saturated" : False, "clean" : False}
+        if width not in self.photons:
+            return result
+        ph, phErr = self.photons[width]
+        gain, gainErr = pmt_gain.calc_gain(area, area_err, ph, phErr)
+        result["gain"], result["gain_err"] = float(gain), float(gainErr)
+        if y is None:
+            y = load_raw(self.rawDir, width)
+        if y is not None:
+            result["saturated"], result["sat_frac"] = calibration.check_saturation(y, self.clip_samples,
+                                                                                  self.max_clipped)
+            self.saturated += result["saturated"]
+            result["clean"] = not result["saturated"] and result["gain"] > 0
+        if result["clean"]:
+            self.include(result["gain"], result["gain_err"])
+        return result
+
+    def include(self, gain, gain_err):
+        # Inverse variance weights, as calibration's final gain
+        weight = 1. / gain_err**2 if gain_err > 0 else 0.
+        if self.pending is None:
+            self.mean.add(gain, weight)
+            return
+        self.pending.append((gain, weight))
+        if len(self.pending) == self.pending.maxlen:
+            self.mean.add(*self.pending.popleft())
+
+    def summary(self, result):
+        """One line report for a width and the run so far"""
+        mean, std = self.mean.result()
+        flag = " SATURATED" if result["saturated"] else ""
+        return "WIDTH %5i  gain %.3e +/- %.1e  clipped %5.1f%%%s  |  running gain %.3e +/- %.1e (%i widths), %i/%i saturated" % (
+            result["width"], result["gain"], result["gain_err"], 100*result["sat_frac"], flag,
+            mean, std, self.mean.n, self.saturated, self.widths)
+
+
+def load_raw(rawDir, width):
+    """Traces for a width, re-reading the store index so widths added since
+    the last call are seen
+    """
+    file = '%s/Width%05d.pkl' % (rawDir, width)
+    if os.path.isfile(file):
+        return calibration.calc.readPickleChannel(file, 1)[1]
+    if calibration.waveform_store.has_store(rawDir):
+        store = calibration.waveform_store.WaveformStore(rawDir)
+        if width in store:
+            return store.read(width)
+    return None
+
+
+class ScanTail(object):
+    """New complete rows of a growing scope scan file"""
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.offset = 0
+        self.partial = ""
+
+    def poll(self):
+        """Return (restarted, rows) where rows are the value arrays of the
+        lines added since the last poll. restarted is True if the file was
+        rewritten (e.g. compacted on resume) and has been read from the top.
+        """
+        if not os.path.isfile(self.fileName):
+            return False, []
+        restarted = os.path.getsize(self.fileName) < self.offset
+        if restarted:
+            self.offset, self.partial = 0, ""
+        with open(self.fileName, 'r') as file:
+            file.seek(self.offset)
+            text = file.read()
+            self.offset = file.tell()
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        rows = []
+        for line in lines:
+            bits = line.split()
+            if line.startswith("#") or len(bits) != len(calibration.SCAN_DTYPE.names):
+                continue
+            rows.append(np.array(bits, dtype=float))
+        return restarted, rows
+
+
+###############
+# MAIN FUNCTION
+###############
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-p", dest="powerFile", help="Power meter file")
+    parser.add_option("-s", dest="scopeFile", help="Scope scan file being written")
+    parser.add_option("--clip-samples", dest="clipSamples", type="int", default=4,
+                      help="Samples at a trace's minimum before it counts as clipped")
+    parser.add_option("--max-clipped", dest="maxClipped", type="int", default=10,
+                      help="Clipped traces allowed before a width is saturated")
+    parser.add_option("--interval", dest="interval", type="float", default=2.,
+                      help="Seconds between checks of the scan file")
+    parser.add_option("--idle", dest="idle", type="float", default=0.,
+                      help="Stop after this many seconds without a new width (0: run until interrupted)")
+    (options,args) = parser.parse_args()
+
+    head, pm = pm_data.read_power_meter_file(options.powerFile)
+    rawDir = os.path.join(os.path.dirname(options.scopeFile), "raw_data",
+                          "Channel_%02d" % calibration.scan_channel(options.scopeFile))
+    columns = dict((name, i) for i, name in enumerate(calibration.SCAN_DTYPE.names))
+    tail = ScanTail(options.scopeFile)
+    live = LiveGain(head, pm, rawDir, options.clipSamples, options.maxClipped)
+    last_row = time.time()
+    try:
+        while True:
+            restarted, rows = tail.poll()
+            if restarted:
+                print "Scan file was rewritten, starting again from the top"
+                live = LiveGain(head, pm, rawDir, options.clipSamples, options.maxClipped)
+            for row in rows:
+                result = live.add(row[columns["ipw"]], row[columns["area"]], row[columns["area_err"]])
+                print live.summary(result)
+                last_row = time.time()
+            if options.idle and time.time() - last_row > options.idle:
+                break
+            time.sleep(options.interval)
+    except KeyboardInterrupt:
+        pass
+    mean, std = live.mean.result()
+    print "Gain so far: %.3e +/- %.3e from %i clean widths (%i of %i saturated)" % (mean, std, live.mean.n,
+                                                                                   live.saturated, live.widths)
@@ -0,0 +1,273 @@
+###################################################
+# Photoelectron fits to per-width charge spectra.
+#
+# The charge of every trace is histogrammed and
+# fitted with a Poisson sum of Gaussians:
+#
+#   f(q) = N sum_n P(n; mu) G(q; q0 + n*Q1,
+#                           sqrt(s0^2 + n*s1^2))
+#
+# giving the mean number of photoelectrons (mu) and
+# the single PE charge Q1 = gain*e without the power
+# meter. Above resolve_mu PE the peaks merge and
+# only the mean and width of the spectrum constrain
+# the fit, so q0, s0 and s1/Q1 are then held at the
+# values fitted where the peaks were resolved.
+#
+# Widths are fitted in order of increasing light,
+# each starting from its neighbour's result. With -j
+# the widths up to the first one past resolve_mu are
+# fitted serially, then the rest go to separate
+# processes in contiguous runs, each starting from
+# the pedestal and resolution measured there.
+#
+# python PMT_cal/pe_fit.py -s data/scope_data_1.00V/Chan05_1.00V.dat -j 4
+###################################################
+import os
+import re
+import time
+import optparse
+import multiprocessing
+import numpy as np
+import scipy.optimize
+import scipy.stats
+import features
+import pmt_gain
+
+UNIT = 1e-12        # fits are done in pC
+MAX_MU = 2000.      # beyond this the spectrum is a single Gaussian, don't fit
+PE_DTYPE = np.dtype([("width", np.int64), ("mu", np.float64), ("mu_err", np.float64),
+                     ("gain", np.float64), ("gain_err", np.float64), ("q0", np.float64),
+                     ("sigma0", np.float64), ("resolution", np.float64), ("chi2_ndf", np.float64),
+                     ("n_traces", np.int64), ("ok", np.bool_)])
+
+
+def histogram(q, bins=200, tail=5e-4):
+    """Histogram of charges, ignoring a fraction tail at each end.
+    Returns (bin centres, counts, bin width).
+    """
+    lo, hi = np.percentile(q, [100*tail, 100*(1-tail)])
+    pad = 0.05*(hi - lo)
+    counts, edges = np.histogram(q, bins=bins, range=(lo - pad, hi + pad))
+    return 0.5*(edges[1:] + edges[:-1]), counts.astype(float), edges[1] - edges[0]
+
+def n_terms(mu):
+    """Number of Poisson terms needed to cover mu"""
+    return int(mu + 6*np.sqrt(mu) + 6)
+
+def pe_model(q, norm, mu, q0, sigma0, q1, resolution):
+    """Expected counts per bin at charges q (all in the same units).
+    resolution is sigma1 / Q1.
+    """
+    n = np.arange(n_terms(mu) + 1)
+    weights = scipy.stats.poisson.pmf(n, mu)
+    sigma = np.sqrt(sigma0**2 + n*(resolution*q1)**2)
+    z = (q[:,np.newaxis] - q0 - n*q1) / sigma
+    return norm*np.exp(-0.5*z*z).dot(weights / (np.sqrt(2*np.pi)*sigma))
+
+def initial_guess(q, resolution=0.35):
+    """Starting (mu, q0, sigma0, Q1) from the moments of a charge spectrum,
+    taking the pedestal at zero (charges are baseline subtracted)
+    """
+    mean, var = np.mean(q), np.var(q)
+    low = q[q < np.percentile(q, 10)]
+    sigma0 = max(1.4826*np.median(np.abs(low - np.median(low))), 1e-3*np.std(q))
+    q1 = max(var - sigma0**2, 1e-6*var) / max(mean, 1e-12) / (1 + resolution**2)
+    return max(mean / q1, 0.05), 0., sigma0, q1
+
+def fit_spectrum(q, start=None, resolution=0.35, resolve_mu=10., bins=200):
+    """Fit one width's charges (pC). start is a previous fit's (mu, q0, sigma0,
+    Q1, resolution) to begin from, rescaled to this width's mean charge.
+    Above resolve_mu only mu and Q1 are fitted; the pedestal, its width and
+    the resolution are held at start's values (or the defaults).
+    Returns (params, errors, chi2/ndf, ok); errors are nan where a parameter
+    was held fixed.
+    """
+    centres, counts, bin_width = histogram(q, bins)
+    norm = len(q)*bin_width
+    if start is None:
+        mu, q0, sigma0, q1 = initial_guess(q, resolution)
+    else:
+        mu, q0, sigma0, q1, resolution = start
+        mu = max((np.mean(q) - q0) / q1, 0.05)
+    params = np.array([mu, q0, sigma0, q1, resolution], dtype=float)
+    if not np.all(np.isfinite(params)) or not 0 < mu < MAX_MU:
+        return params, np.nan*np.ones(5), np.nan, False
+    free = np.ones(5, dtype=bool) if mu < resolve_mu else np.array([True, False, False, True, False])
+    scale = np.std(q)
+    lower = np.array([0., -np.inf, 1e-6*scale, 1e-6*scale, 0.])[free]
+    upper = np.array([MAX_MU, np.inf, np.inf, np.inf, 2.])[free]
+    p0 = np.clip(params[free], lower, upper)
+
+    def unpack(p):
+        full = params.copy()
+        full[free] = p
+        return full
+
+    def residuals(p):
+        return (counts - pe_model(centres, norm, *unpack(p))) / np.sqrt(np.maximum(counts, 1.))
+
+    errors = np.nan*np.ones(5)
+    try:
+        fit = scipy.optimize.least_squares(residuals, p0, bounds=(lower, upper), x_scale='jac')
+    except (ValueError, np.linalg.LinAlgError):
+        return params, errors, np.nan, False
+    ndf = max(len(counts) - len(p0), 1)
+    try:
+        errors[free] = np.sqrt(np.diag(np.linalg.inv(fit.jac.T.dot(fit.jac))))
+    except np.linalg.LinAlgError:
+        pass
+    return unpack(fit.x), errors, 2*fit.cost / ndf, bool(fit.success)
+
+def width_charges(rawDir, width, chunk=features.CHUNK_TRACES, baseline=20, window=None):
+    """Charge (pC) of every trace of a width, None if no raw data"""
+    parts = [features.charge(y, x_incr, baseline, window) / UNIT
+             for y, x_incr in features.iter_chunks(rawDir, width, chunk)]
+    if not parts:
+        return None
+    return np.concatenate(parts)
+
+class WarmStart(object):
+    """Starting point for the next width: the pedestal and resolution of the
+    fit that measured the resolution best, the rest from the last good fit
+    """
+
+    def __init__(self):
+        self.start = None
+        self.best = None
+        self.best_err = np.inf
+
+    def update(self, params, errors):
+        if errors[4] < self.best_err:
+            self.best, self.best_err = params, errors[4]
+        self.start = params.copy()
+        if self.best is not None:
+            self.start[[1, 2, 4]] = self.best[[1, 2, 4]]
+
+def fit_width(row, q, warm, resolution, resolve_mu, bins):
+    """Fit one width's charges into a PE_DTYPE row, updating warm if the fit
+    succeeded. Returns the fitted params.
+    """
+    params, errors, chi2_ndf, ok = fit_spectrum(q, warm.start, resolution, resolve_mu, bins)
+    mu, q0, sigma0, q1, res = params
+    row["mu"], row["mu_err"] = mu, errors[0]
+    row["gain"] = q1*UNIT / pmt_gain.E_CHARGE
+    row["gain_err"] = errors[3]*UNIT / pmt_gain.E_CHARGE
+    row["q0"], row["sigma0"], row["resolution"] = q0, sigma0, res
+    row["chi2_ndf"], row["n_traces"], row["ok"] = chi2_ndf, len(q), ok
+    if ok:
+        warm.update(params, errors)
+    return params
+
+def empty_fits(widths):
+    out = np.zeros(len(widths), dtype=PE_DTYPE)
+    out["width"] = widths
+    out["mu"] = np.nan
+    return out
+
+def fit_widths(args):
+    """Fit a run of neighbouring widths, each warm started from the last.
+    Takes a single (rawDir, widths, chunk, baseline, window, bins, resolution,
+    resolve_mu, warm) tuple so it can be mapped over a process pool; warm is
+    a WarmStart to begin from, or None.
+    Returns a PE_DTYPE array in the order of widths given.
+    """
+    rawDir, widths, chunk, baseline, window, bins, resolution, resolve_mu, warm = args
+    out = empty_fits(widths)
+    charges = [width_charges(rawDir, w, chunk, baseline, window) for w in widths]
+    means = [np.mean(q) if q is not None and len(q) else np.nan for q in charges]
+    warm = warm or WarmStart()
+    for i in np.argsort(means):
+        q = charges[i]
+        if q is None or len(q) < 10:
+            continue
+        fit_width(out[i:i+1], q, warm, resolution, resolve_mu, bins)
+    return out
+
+def fit_resolved(rawDir, widths, chunk, baseline, window, bins, resolution, resolve_mu):
+    """Fit widths in order, one at a time, up to and including the first
+    good fit past resolve_mu, i.e. the region where the pedestal and
+    resolution are measured. Returns (PE_DTYPE array of the widths fitted,
+    WarmStart for the rest).
+    """
+    out, warm = empty_fits(widths), WarmStart()
+    for i, w in enumerate(widths):
+        q = width_charges(rawDir, w, chunk, baseline, window)
+        if q is None or len(q) < 10:
+            continue
+        mu = fit_width(out[i:i+1], q, warm, resolution, resolve_mu, bins)[0]
+        if out[i]["ok"] and mu >= resolve_mu:
+            return out[:i+1], warm
+    return out, warm
+
+def fit_scan(rawDir, widths, chunk=features.CHUNK_TRACES, baseline=20, window=None, bins=200,
+             resolution=0.35, resolve_mu=10., workers=1):
+    """PE fits for all widths of a scan. With workers > 1 the resolved
+    widths are fitted first and the rest split into workers contiguous runs,
+    all started from the resolved fits. Returns a PE_DTYPE array in width
+    order.
+    """
+    widths = np.sort(np.asarray(widths, dtype=int))
+    if workers > 1:
+        resolved, warm = fit_resolved(rawDir, widths, chunk, baseline, window, bins, resolution, resolve_mu)
+        rest = widths[len(resolved):]
+    else:
+        resolved, warm, rest = empty_fits([]), None, widths
+    runs = [run for run in np.array_split(rest, max(1, min(workers, len(rest)))) if len(run)]
+    jobs = [(rawDir, run, chunk, baseline, window, bins, resolution, resolve_mu, warm) for run in runs]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(fit_widths, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [fit_widths(job) for job in jobs]
+    return np.concatenate([resolved] + results)
+
+def write_fits(fileName, fits):
+    with open(fileName, 'w') as output_file:
+        output_file.write("#WIDTH\tMU\tMU Error\tGAIN\tGAIN Error\tQ0 (pC)\tSIGMA0 (pC)\tSIGMA1/Q1\tCHI2/NDF\tTRACES\tOK\n")
+        for f in fits:
+            output_file.write("%i\t%.5e\t%.3e\t%.5e\t%.3e\t%.4e\t%.4e\t%.4f\t%.3f\t%i\t%i\n" % tuple(f))
+
+
+###############
+# MAIN FUNCTION
+###############
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-s", dest="scopeFile", help="Scope scan file (its widths are fitted)")
+    parser.add_option("-o", dest="outFile", default=None, help="Output file (default: <scan file>_pe.dat)")
+    parser.add_option("--baseline", dest="baseline", type="int", default=20,
+                      help="Leading samples averaged for the baseline")
+    parser.add_option("--window", dest="window", default=None,
+                      help="Integration window as first:last sample (default: whole trace)")
+    parser.add_option("--bins", dest="bins", type="int", default=200, help="Charge histogram bins")
+    parser.add_option("--resolution", dest="resolution", type="float", default=0.35,
+                      help="Starting single PE resolution, sigma1/Q1")
+    parser.add_option("--resolve-mu", dest="resolveMu", type="float", default=10.,
+                      help="Above this many PE sigma1/Q1 is held at its neighbour's value")
+    parser.add_option("-j", dest="workers", type="int", default=1, help="Worker processes")
+    (options,args) = parser.parse_args()
+    scriptTime = time.time()
+
+    # Only the command line needs the analysis code
+    import calibration
+    rawDir = os.path.join(os.path.dirname(options.scopeFile), "raw_data",
+                          "Channel_%02d" % calibration.scan_channel(options.scopeFile))
+    window = None
+    if options.window:
+        window = tuple(int(b) for b in options.window.split(":"))
+    scan = calibration.read_scope_scan(options.scopeFile)
+    fits = fit_scan(rawDir, scan["ipw"], baseline=options.baseline, window=window, bins=options.bins,
+                    resolution=options.resolution, resolve_mu=options.resolveMu, workers=options.workers)
+
+    outFile = options.outFile or re.sub(r"\.dat$", "", options.scopeFile) + "_pe.dat"
+    write_fits(outFile, fits)
+    good = fits[fits["ok"] & (np.nan_to_num(fits["gain_err"]) > 0)]
+    if len(good):
+        gain, gain_err = calibration.weighted_avg_and_std(good["gain"], 1. / good["gain_err"]**2)
+        print "PE fit gain: %.3e +/- %.3e from %i widths" % (gain, gain_err, len(good))
+    print "Wrote %s (%i of %i widths fitted) in %1.1f s" % (outFile, len(good), len(fits), time.time()-scriptTime)
@@ -0,0 +1,125 @@
+###################################################
+# Predict the 'scope vertical scale and trigger
+# level for each width of a sweep from the photons
+# per pulse in the power meter file, so the scope
+# starts each width already ranged instead of
+# autoscaling from the previous width's peak.
+#
+#   peak (V) = k * photons,  k = -gain*e*R / tau
+#
+# k starts from a gain estimate (if given) and is
+# refined by a ratio fit to the measured peaks as
+# widths complete. Older widths are gradually
+# forgotten, so k follows any non-linearity along
+# the sweep, but peaks too close to the noise are
+# ignored and k can change by at most a factor
+# max_step per width.
+###################################################
+import numpy as np
+import pmt_gain
+
+# 1-2-5 sequence of vertical scales (V/div) available on the scope
+SCALES = np.array([1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1.])
+PRESET_DTYPE = np.dtype([("width", np.int64), ("photons", np.float64), ("peak", np.float64),
+                         ("scale", np.float64), ("trigger", np.float64)])
+
+
+class PeakModel(object):
+    """Expected pulse minimum (V) as a function of photons per pulse.
+
+    gain        -- initial gain estimate, or None to wait for the first width
+    pulse_time  -- effective pulse duration, charge / peak current (s)
+    noise       -- noise on a measured peak (V); peaks below min_snr times
+                   this (or their own error, if larger) are not used
+    min_photons -- widths with fewer photons are not used
+    memory      -- weight kept by earlier widths in the ratio fit, per width
+    max_step    -- largest factor k may change by in one update
+    """
+
+    def __init__(self, gain=None, pulse_time=5e-9, termination=50., noise=1e-3, min_snr=5.,
+                 min_photons=0., memory=0.5, max_step=2.):
+        self.k = None
+        if gain is not None:
+            self.k = -gain*pmt_gain.E_CHARGE*termination / pulse_time
+        self.noise = noise
+        self.min_snr = min_snr
+        self.min_photons = min_photons
+        self.memory = memory
+        self.max_step = max_step
+        self.sum_pp = 0.
+        self.sum_py = 0.
+
+    def update(self, photons, peak, peak_err=0.):
+        """Refine the model with a measured peak. Returns True if it was used."""
+        if not (photons > self.min_photons and peak < 0):
+            return False
+        if -peak < self.min_snr*max(self.noise, peak_err):
+            return False
+        # Least squares fit of peak = k*photons, earlier widths down-weighted
+        self.sum_pp = self.memory*self.sum_pp + photons*photons
+        self.sum_py = self.memory*self.sum_py + photons*peak
+        k = self.sum_py / self.sum_pp
+        if self.k is not None:
+            # k is negative: k*max_step is the lower limit
+            k = min(max(k, self.k*self.max_step), self.k / self.max_step)
+        self.k = float(k)
+        return True
+
+    def predict(self, photons):
+        """Expected peak (V) for an array of photon counts, NaN if unknown"""
+        photons = np.asarray(photons, dtype=float)
+        if self.k is None:
+            return np.nan*photons
+        return self.k*photons
+
+
+def vertical_scale(peak, divisions=6.5, headroom=1.2):
+    """Smallest scale (V/div) keeping |peak|*headroom within the divisions
+    below the trace (6.5 with the channel at +2.5 div)
+    """
+    needed = np.abs(np.asarray(peak, dtype=float))*headroom / divisions
+    idx = np.searchsorted(SCALES, np.nan_to_num(needed))
+    return SCALES[np.minimum(idx, len(SCALES)-1)]
+
+def trigger_level(peak, fraction=0.5, min_trigger=-0.004):
+    """Trigger at a fraction of the expected peak, no closer to zero than min_trigger"""
+    return np.minimum(fraction*np.nan_to_num(np.asarray(peak, dtype=float)), min_trigger)
+
+
+class PresetTable(object):
+    """Scale and trigger presets for every width of a sweep"""
+
+    def __init__(self, widths, photons, model, trigger_frac=0.5, min_trigger=-0.004):
+        self.model = model
+        self.trigger_frac = trigger_frac
+        self.min_trigger = min_trigger
+        self.table = np.zeros(len(widths), dtype=PRESET_DTYPE)
+        self.table["width"] = widths
+        self.table["photons"] = photons
+        self.rows = dict((int(w), i) for i, w in enumerate(widths))
+        self.refresh()
+
+    def refresh(self, start=0):
+        """Recompute the presets from row start onwards with the current model"""
+        rows = self.table[start:]
+        rows["peak"] = self.model.predict(rows["photons"])
+        rows["scale"] = vertical_scale(rows["peak"])
+        rows["trigger"] = trigger_level(rows["peak"], self.trigger_frac, self.min_trigger)
+
+    def preset(self, width):
+        """(peak, scale, trigger) for a width; peak is None if not yet predictable"""
+        row = self.table[self.rows[int(width)]]
+        peak = None if np.isnan(row["peak"]) else float(row["peak"])
+        return peak, float(row["scale"]), float(row["trigger"])
+
+    def completed(self, width, peak, peak_err=0.):
+        """Feed back a width's measured peak and update the remaining presets"""
+        i = self.rows[int(width)]
+        if self.model.update(self.table["photons"][i], peak, peak_err):
+            self.refresh(i+1)
+
+    def write(self, fileName):
+        with open(fileName, 'w') as file:
+            file.write("#WIDTH\tPHOTONS\tPEAK\tSCALE\tTRIGGER\n")
+            for row in self.table:
+                file.write("%i\t%.4e\t%.4e\t%.3e\t%.4e\n" % tuple(row))
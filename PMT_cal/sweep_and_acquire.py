@@ -14,34 +14,90 @@ from core import serial_command
 import scopes
 import scope_connections
 import sweep
+import waveform_store
+import pm_data
+import instrument_tasks
+import segmented
+import features
+import scope_presets
+import checkpoint
+import waveform_codec
 # standard libray stuff
 import time
 import sys
 import math
 import os
+import re
 import optparse
 import numpy as np
 
-def readPowerMeterFile(fileName):
-    """Read previously generated power meter file"""
-    # Open file, read only the first line
-    with open(fileName, 'r') as file:
-        header = file.readline()
-    # Return as dict.
-    tmp = header.split(" ")
-    head = {"Wavelength" : int(tmp[0]), "Pulse sep" : float(tmp[1]), "Rate" : int(tmp[2]), "Temp" : float(tmp[3]), "Pedestal" : float(tmp[4]) }
-    noLin = sum(1 for line in open(fileName)) - 1  ###-1 to correct for header
-
-    # Open file
-    widths, c = np.zeros(noLin, dtype=int), 0
-    with open(fileName, 'r') as file:
-        next(file)
-        for line in file:
-            tmp = line.split(" ")
-            widths[c] = np.int(tmp[0])
-            c=c+1
-    # return filled lists
-    return head, widths
+
+def write_record(output_file, width, tmpResults):
+    """Append one width's results to the data file, and make sure it's
+    on disk before returning so a crash loses at most the width in progress.
+    """
+    output_file.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n"%(width, 0,
+                                        tmpResults["pin"], 0,
+                                        tmpResults["width"], tmpResults["width error"],
+                                        tmpResults["rise"], tmpResults["rise error"],
+                                        tmpResults["fall"], tmpResults["fall error"],
+                                        tmpResults["area"], tmpResults["area error"],
+                                        tmpResults["peak"], tmpResults["peak error"] ))
+    output_file.flush()
+    os.fsync(output_file.fileno())
+
+def store_raw(store, pkl_file, width, scope_chan, preamble, encoding, drop):
+    """Copy a width's raw pickle into the waveform store, as codes with the
+    preamble the scope reported for it
+    """
+    store.append_pickle(width, pkl_file, scope_chan, preamble, encoding)
+    if drop:
+        os.remove(pkl_file)
+
+def acquire_segmented(sc, frames, channel, width, pulse_delay_ms, trigger):
+    """Fire one sequence of TELLIE pulses at a width, capturing each pulse as
+    a FastFrame segment. Returns the results dict (as sweep.sweep) and the
+    segments as ADC codes.
+    """
+    sc.set_pulse_width(width)
+    frames.set_trigger(trigger)
+    # The sequence takes segments*pulse sep; allow plenty for the serial link
+    timeout = 2*frames.segments*pulse_delay_ms*1e-3 + 5.
+    codes = frames.acquire(sc.fire_sequence, timeout)
+    pin = None
+    while pin==None:
+        pin, rms, _ = sc.tmp_read_rms()
+    y = waveform_codec.to_volts(codes, frames.preamble)
+    results = features.summarise(features.extract(y, frames.preamble["XINCR"]))
+    results["pin"] = int(pin[channel])
+    return results, codes
+
+def save_width(output_file, store, rawDir, width, tmpResults, scope_chan, preamble, options, codes=None):
+    """All the file I/O for one width"""
+    write_record(output_file, width, tmpResults)
+    if codes is not None:
+        store.append(width, codes, preamble.get("XZERO", 0.), preamble["XINCR"], preamble, options.encoding)
+    elif store is not None:
+        pkl_file = "%sWidth%05d.pkl" % (rawDir,width)
+        store_raw(store, pkl_file, width, scope_chan, preamble, options.encoding, options.dropPickles)
+
+def saved_widths(rawDir):
+    """Widths whose raw traces are on disk, as pickles or in the waveform store"""
+    saved = set()
+    if os.path.isdir(rawDir):
+        for name in os.listdir(rawDir):
+            match = re.match(r"Width(\d+)\.pkl$", name)
+            if match:
+                saved.add(int(match.group(1)))
+    if waveform_store.has_store(rawDir):
+        saved.update(waveform_store.WaveformStore(rawDir).widths())
+    return saved
+
+def check_tasks(tasks):
+    """Re-raise any error from finished writer tasks and drop them"""
+    for task in [t for t in tasks if t.done.is_set()]:
+        task.result()
+        tasks.remove(task)
 
 
 ##########################
@@ -52,11 +108,43 @@ if __name__ == "__main__":
     parser.add_option("-f",dest="file",help="Power meter file to be loaded")
     parser.add_option("-c",dest="channel",help="Channel number (1-8)")
     parser.add_option("-v",dest="voltage",help="Gain setting at PMT (V)")
+    parser.add_option("--store",dest="store",action="store_true",default=False,
+                      help="Copy each width's raw traces into the binary waveform store")
+    parser.add_option("--drop-pickles",dest="dropPickles",action="store_true",default=False,
+                      help="Delete each raw pickle once it is in the waveform store")
+    parser.add_option("--encoding",dest="encoding",default="raw",
+                      help="Waveform store encoding: raw, zlib or delta+zlib (stored as ADC codes)")
+    parser.add_option("--pipeline",dest="pipeline",action="store_true",default=False,
+                      help="Write results and raw traces from a background thread while the next width is acquired")
+    parser.add_option("--queue",dest="queue",type="int",default=4,
+                      help="Widths allowed to wait for the writer with --pipeline before acquisition blocks")
+    parser.add_option("--trace",dest="trace",default=None,
+                      help="With --pipeline, save the start and end of every acquisition and write to this file")
+    parser.add_option("--segments",dest="segments",type="int",default=0,
+                      help="Capture this many pulses per width as FastFrame segments, transferred in one block")
+    parser.add_option("--presets",dest="presets",action="store_true",default=False,
+                      help="Range the scope for each width from the power meter photons, refined as widths complete")
+    parser.add_option("--gain",dest="gain",type="float",default=None,
+                      help="Gain estimate for the --presets model before the first width is measured")
+    parser.add_option("--pulse-time",dest="pulseTime",type="float",default=5e-9,
+                      help="Effective pulse duration (charge/peak current) for the --presets model (s)")
+    parser.add_option("--preset-noise",dest="presetNoise",type="float",default=1e-3,
+                      help="Peak noise (V); only peaks 5 times above it refine the --presets model")
+    parser.add_option("--resume",dest="resume",action="store_true",default=False,
+                      help="Keep widths already in the output file (with raw data saved) and acquire only the rest")
+    parser.add_option("--temp-tol",dest="tempTol",type="float",default=2.0,
+                      help="Power meter temperature change allowed when resuming (Celsius)")
+    parser.add_option("--live",dest="live",action="store_true",default=False,
+                      help="Print the gain, saturation and running gain as each width completes")
     (options,args) = parser.parse_args()
+    if options.segments:
+        # There are no pickles in segmented mode; the store holds the raw data
+        options.store = True
     total_time = time.time()
 
     # Read in power meter file to get width / frequency settings
-    header, widths = readPowerMeterFile(options.file)
+    header, pm = pm_data.read_power_meter_file(options.file)
+    widths = pm["width"]
 
     #widths = range(7200,7500,100)
     print widths
@@ -99,16 +187,60 @@ if __name__ == "__main__":
     scope.set_data_mode(half_length-50, half_length+50)
     scope.lock()
     scope.begin() # Acquires the pre-amble!
+    # Raw traces are stored as ADC codes with the preamble the scope reports
+    # after each width (the vertical scale, so YMULT, changes between widths)
+    preamble = None
+    frames = None
+    if options.segments:
+        frames = segmented.SegmentedAcquisition(usb_conn, scope_chan, options.segments)
+        frames.setup()
+        preamble = frames.preamble
+        sc.set_pulse_number(frames.segments)
 
     #File system stuff
     saveDir = sweep.check_dir("data/scope_data_%1.2fV/" % float(options.voltage))
     sweep.check_dir("%sraw_data/" % saveDir)
     output_filename = "%s/Chan%02d_%1.2fV.dat" % (saveDir,channel,float(options.voltage))
-    output_file = file(output_filename,'w')
-    output_file.write("#PWIDTH\tPWIDTH Error\tPIN\tPIN Error\tWIDTH\tWIDTH Error\tRISE\tRISE Error\tFALL\t\
+    rawDir = "%sraw_data/Channel_%02d/" % (saveDir,channel)
+    store = waveform_store.WaveformStore(sweep.check_dir(rawDir)) if options.store else None
+    conditions = {"Wavelength" : header["Wavelength"], "Pulse sep" : header["Pulse sep"],
+                  "Temp" : header["Temp"], "Voltage" : float(options.voltage)}
+    if options.resume and os.path.isfile(output_filename):
+        # Only widths with a valid row and their raw traces saved count as done
+        old_header, _ = checkpoint.read_rows(output_filename, 14)
+        checkpoint.check_conditions(checkpoint.parse_conditions(old_header), conditions,
+                                    {"Wavelength" : 0, "Pulse sep" : 1e-6*header["Pulse sep"],
+                                     "Temp" : options.tempTol, "Voltage" : 1e-3})
+        saved = saved_widths(rawDir)
+        done = checkpoint.compact(output_filename, 14, valid=lambda w, values: w in saved)
+        widths = checkpoint.remaining(widths, done)
+        print "Resuming: %i widths already acquired, %i to go" % (len(done), len(widths))
+        output_file = file(output_filename,'a')
+    else:
+        output_file = file(output_filename,'w')
+        output_file.write("#PWIDTH\tPWIDTH Error\tPIN\tPIN Error\tWIDTH\tWIDTH Error\tRISE\tRISE Error\tFALL\t\
 FALL Error\tAREA\tAREA Error\tMinimum\tMinimum Error\n")
+        output_file.write(checkpoint.format_conditions(conditions))
+
+    presets = None
+    if options.presets:
+        model = scope_presets.PeakModel(options.gain, options.pulseTime, termination, options.presetNoise)
+        presets = scope_presets.PresetTable(pm["width"], pm["photons"], model, trigger_level, min_trigger)
+        presets.write("%sChan%02d_presets.dat" % (saveDir, channel))
+
+    live = None
+    if options.live:
+        # Only needed here (it brings in the analysis code)
+        import live_gain
+        live = live_gain.LiveGain(header, pm, rawDir)
 
     flag, tmpResults, min_volt = 0, None, None
+    # Time the acquisition loop spends waiting on file I/O, and the time the
+    # I/O itself takes (the two are equal when running sequentially)
+    stalled, trace, tasks = 0., None, []
+    if options.pipeline:
+        trace = instrument_tasks.OverlapTrace()
+        writer = instrument_tasks.DeviceWorker("writer", trace, max_pending=options.queue)
     run_start = time.time()
     for width in widths:
         loop_start = time.time()
@@ -116,18 +248,63 @@ FALL Error\tAREA\tAREA Error\tMinimum\tMinimum Error\n")
             #set a best guess for the trigger and the scale
             #using the last sweeps value
             min_volt = float(tmpResults["peak"])
+        trigger = min_trigger if min_volt is None else trigger_level*min_volt
+        scale = None if min_volt is None else float(scope_presets.vertical_scale(min_volt))
+        if presets is not None:
+            peak, preset_scale, preset_trigger = presets.preset(width)
+            if peak is not None:
+                min_volt, scale, trigger = peak, preset_scale, preset_trigger
+        if frames is not None and scale is not None:
+            # sweep.sweep autoscales from min_volt; FastFrame has to be told
+            frames.set_scale(scale)
 
-        tmpResults = sweep.sweep(saveDir,1,channel,width,pulse_delay_ms,scope,min_volt)        
+        codes = None
+        acquire_start = time.time()
+        if frames is not None:
+            tmpResults, codes = acquire_segmented(sc, frames, channel, width, pulse_delay_ms, trigger)
+            preamble = frames.preamble
+        else:
+            tmpResults = sweep.sweep(saveDir,1,channel,width,pulse_delay_ms,scope,min_volt)
+            if store is not None:
+                preamble = segmented.read_preamble(usb_conn)
+        if trace is not None:
+            trace.record("scope", "width %i" % width, acquire_start, time.time())
+        if presets is not None:
+            presets.completed(width, float(tmpResults["peak"]), float(tmpResults.get("peak error", 0.)))
+        if live is not None:
+            # Before the write below, which may move the raw pickle into the store
+            print live.summary(live.add(width, tmpResults["area"], tmpResults["area error"], codes))
 
-        output_file.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n"%(width, 0,
-                                            tmpResults["pin"], 0,
-                                            tmpResults["width"], tmpResults["width error"],
-                                            tmpResults["rise"], tmpResults["rise error"],
-                                            tmpResults["fall"], tmpResults["fall error"],
-                                            tmpResults["area"], tmpResults["area error"],
-                                            tmpResults["peak"], tmpResults["peak error"] ))
+        io_start = time.time()
+        if options.pipeline:
+            check_tasks(tasks)
+            # Blocks only if the writer has fallen options.queue widths behind
+            tasks.append(writer.submit(save_width, output_file, store, rawDir, width, tmpResults,
+                                       scope_chan, preamble, options, codes))
+        else:
+            save_width(output_file, store, rawDir, width, tmpResults, scope_chan, preamble, options, codes)
+        stalled += time.time() - io_start
 
         print "WIDTH %d took : %1.1f s" % (width, time.time()-loop_start)
 
+    io_start = time.time()
+    if options.pipeline:
+        writer.close()
+        check_tasks(tasks)
+        io_time = trace.busy_time().get("writer", 0.)
+    stalled += time.time() - io_start
+    if not options.pipeline:
+        io_time = stalled
     output_file.close()
+    if options.resume:
+        # One row per width, in order, as the file was before it was resumed
+        checkpoint.compact(output_filename, 14)
+    run_time = time.time() - run_start
+    print "File I/O took %1.1f s; acquisition was stalled on it for %1.1f s (%1.1f%% of %1.1f s run)" % \
+        (io_time, stalled, 100.*stalled/run_time, run_time)
+    if options.pipeline:
+        print "Sequential writes would have stalled acquisition for %1.1f s" % io_time
+        print trace.summary()
+        if options.trace:
+            trace.write(options.trace)
     print "Total script time : %1.1f mins"%( (time.time() - total_time) / 60)
@@ -0,0 +1,130 @@
+###################################################
+# Compact integer encoding of scope waveforms.
+# Traces are kept as the raw 8/16 bit ADC codes
+# together with the scope preamble, optionally
+# delta coded and zlib compressed in blocks of
+# traces. Volts are only computed on request:
+#   volts = (code - YOFF)*YMULT + YZERO
+###################################################
+import struct
+import zlib
+import numpy as np
+
+ENCODINGS = ("raw", "zlib", "delta+zlib")
+CODE_TYPES = {1 : np.dtype(np.int8), 2 : np.dtype(np.int16)}
+BLOCK_TRACES = 1024
+
+
+def code_dtype(preamble):
+    """Integer type matching the preamble's BYT_NR"""
+    return CODE_TYPES[int(preamble.get("BYT_NR", 1))]
+
+def to_codes(y, preamble, tol=0.01):
+    """Convert volts back to ADC codes using the scope preamble. Raises
+    ValueError unless every code converts back to y to within tol steps,
+    i.e. y sits on the preamble's code grid and no information is lost.
+    """
+    dtype = code_dtype(preamble)
+    y = np.asarray(y, dtype=np.float64)
+    codes = np.rint((y - preamble["YZERO"]) / preamble["YMULT"] + preamble["YOFF"])
+    info = np.iinfo(dtype)
+    if codes.size and (codes.min() < info.min or codes.max() > info.max):
+        raise ValueError("Waveform does not fit in %i byte codes with this preamble" % dtype.itemsize)
+    codes = codes.astype(dtype)
+    if codes.size:
+        # Rounding always lands within half a step, so anything more than
+        # float noise off the grid means y was rescaled, averaged or filtered
+        worst = np.max(np.abs(to_volts(codes, preamble) - y))
+        if not worst <= tol*abs(preamble["YMULT"]):
+            raise ValueError("Waveform is not on the preamble's code grid (off by %.3g V, YMULT %.3g V)"
+                             % (worst, preamble["YMULT"]))
+    return codes
+
+def to_volts(codes, preamble):
+    """Convert ADC codes to volts (vectorised over any array shape)"""
+    return (np.asarray(codes, dtype=np.float64) - preamble["YOFF"]) * preamble["YMULT"] + preamble["YZERO"]
+
+def infer_preamble(y, byt_nr=1, x_incr=0.):
+    """Estimate a preamble for waveforms that were saved as volts.
+    YMULT is taken as the smallest step between distinct voltage levels,
+    which is exact for data that came off the digitiser unmodified.
+    Raises ValueError if the voltages don't round trip through the inferred
+    codes (they were rescaled or averaged, or span too many steps).
+    """
+    levels = np.unique(np.asarray(y))
+    steps = np.diff(levels)
+    steps = steps[steps > 0]
+    if len(steps) == 0:
+        ymult = 1.
+    else:
+        # Guard against float noise when picking the quantisation step
+        ymult = float(np.median(steps[steps < 1.5*steps.min()]))
+    # Code 0 on the recorded level nearest the middle of the range, so the
+    # grid is anchored on real levels whatever offset the scope used
+    yzero = 0.
+    if len(levels):
+        n_steps = int(np.rint((levels[-1] - levels[0]) / ymult))
+        yzero = float(levels[0] + ymult*((n_steps + 1) // 2))
+    preamble = {"YMULT" : ymult, "YOFF" : 0., "YZERO" : yzero, "XINCR" : float(x_incr), "BYT_NR" : int(byt_nr)}
+    to_codes(y, preamble)
+    return preamble
+
+def encode(codes, encoding="raw", block_traces=BLOCK_TRACES):
+    """Serialise a 2D array of codes. Compressed encodings store blocks of
+    block_traces traces, each prefixed by its compressed length.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown waveform encoding %s" % encoding)
+    codes = np.ascontiguousarray(np.atleast_2d(codes))
+    if encoding == "raw":
+        return codes.tostring()
+    if encoding == "delta+zlib":
+        codes = delta(codes)
+    blocks = []
+    for start in range(0, len(codes), block_traces):
+        comp = zlib.compress(codes[start:start+block_traces].tostring(), 6)
+        blocks.append(struct.pack("<I", len(comp)) + comp)
+    return "".join(blocks)
+
+def decode(blob, n_traces, n_samples, dtype, encoding="raw", traces=None,
+           block_traces=BLOCK_TRACES, preamble=None, volts=False):
+    """Inverse of encode. For compressed encodings only the blocks holding
+    the selected traces are decompressed. Returns codes unless volts is set.
+    """
+    dtype = np.dtype(dtype)
+    if encoding == "raw":
+        codes = np.frombuffer(blob, dtype=dtype).reshape(n_traces, n_samples)
+        if traces is not None:
+            codes = codes[traces]
+    else:
+        wanted = np.arange(n_traces) if traces is None else np.arange(n_traces)[traces]
+        wanted = np.atleast_1d(wanted)
+        needed = set(np.unique(wanted // block_traces))
+        out = np.zeros((len(wanted), n_samples), dtype=dtype)
+        pos = 0
+        for block in range((n_traces + block_traces - 1) // block_traces):
+            length = struct.unpack("<I", blob[pos:pos+4])[0]
+            if block in needed:
+                raw = np.frombuffer(zlib.decompress(blob[pos+4:pos+4+length]), dtype=dtype)
+                raw = raw.reshape(-1, n_samples)
+                if encoding == "delta+zlib":
+                    raw = undelta(raw)
+                sel = (wanted // block_traces) == block
+                out[sel] = raw[wanted[sel] - block*block_traces]
+            pos += 4 + length
+        codes = out
+        if traces is not None and np.ndim(np.arange(n_traces)[traces]) == 0:
+            codes = codes[0]
+    if volts:
+        return to_volts(codes, preamble)
+    return codes
+
+def delta(codes):
+    """Sample-to-sample differences along each trace (wraps in the code type)"""
+    out = codes.copy()
+    out[:,1:] = codes[:,1:] - codes[:,:-1]
+    return out
+
+def undelta(codes):
+    """Inverse of delta"""
+    return np.cumsum(codes, axis=1, dtype=codes.dtype)
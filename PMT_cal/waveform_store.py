@@ -0,0 +1,228 @@
+###################################################
+# Contiguous binary store for the raw PMT traces
+# recorded by sweep_and_acquire.py. One data file
+# per channel and voltage plus a small text index
+# of width -> (offset, n_traces, n_samples), so
+# readers can memory map only the traces needed.
+# Traces may be kept as raw ADC codes with their
+# scope preamble (see waveform_codec.py).
+###################################################
+import calc_utils as calc
+import waveform_codec as codec
+import optparse
+import glob
+import os
+import re
+import sys
+import numpy as np
+
+DATA_NAME = "waveforms.bin"
+INDEX_NAME = "waveforms.idx"
+INDEX_HEADER = "#WIDTH\tOFFSET\tN_TRACES\tN_SAMPLES\tDTYPE\tX_ZERO\tX_INCR\tENCODING\tN_BYTES\tYMULT\tYOFF\tYZERO\n"
+
+
+class WaveformStore(object):
+    """Append-only store of the traces taken at each IPW width.
+
+    The store lives in the same raw_data/Channel_XX/ directory the per-width
+    pickles are written to. Each width is one (n_traces, n_samples) block in
+    the data file; the index records where it starts. If a width is written
+    twice the later block wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data_file = os.path.join(path, DATA_NAME)
+        self.index_file = os.path.join(path, INDEX_NAME)
+        self.index = read_index(self.index_file)
+
+    def __contains__(self, width):
+        return int(width) in self.index
+
+    def widths(self):
+        """Return stored widths in ascending order"""
+        return sorted(self.index.keys())
+
+    def append(self, width, y, x_zero=0., x_incr=0., preamble=None, encoding="raw"):
+        """Append the 2D trace array for one width.
+
+        With a preamble the traces are stored as ADC codes (y may be codes
+        already, or volts which are converted back); encoding selects the
+        optional delta/zlib compression. Without one y is stored as given.
+        """
+        y = np.atleast_2d(y)
+        if preamble is not None and not np.issubdtype(y.dtype, np.integer):
+            y = codec.to_codes(y, preamble)
+        elif preamble is None and encoding != "raw":
+            raise ValueError("Compressed waveforms need a preamble")
+        blob = codec.encode(y, encoding)
+        with open(self.data_file, 'ab') as data:
+            data.seek(0, os.SEEK_END)
+            offset = data.tell()
+            data.write(blob)
+            data.flush()
+            os.fsync(data.fileno())
+        if preamble is None:
+            preamble = {"YMULT" : 0., "YOFF" : 0., "YZERO" : 0.}
+        entry = {"offset" : offset, "n_traces" : y.shape[0], "n_samples" : y.shape[1],
+                 "dtype" : y.dtype.str, "x_zero" : float(x_zero), "x_incr" : float(x_incr),
+                 "encoding" : encoding, "n_bytes" : len(blob), "YMULT" : float(preamble["YMULT"]),
+                 "YOFF" : float(preamble["YOFF"]), "YZERO" : float(preamble["YZERO"])}
+        new_index = not os.path.isfile(self.index_file)
+        with open(self.index_file, 'a') as index:
+            if new_index:
+                index.write(INDEX_HEADER)
+            index.write("%i\t%i\t%i\t%i\t%s\t%.9e\t%.9e\t%s\t%i\t%.9e\t%.9e\t%.9e\n" % (
+                        width, entry["offset"], entry["n_traces"], entry["n_samples"], entry["dtype"],
+                        entry["x_zero"], entry["x_incr"], entry["encoding"], entry["n_bytes"],
+                        entry["YMULT"], entry["YOFF"], entry["YZERO"]))
+        self.index[int(width)] = entry
+
+    def append_pickle(self, width, fileName, scope_chan=1, preamble=None, encoding="raw", byt_nr=None):
+        """Copy a Width%05d.pkl file written by the sweep into the store.
+        If byt_nr is given and no preamble is known, one is inferred from the
+        saved voltages so the traces can be stored as codes. Voltages that
+        don't round trip through the codes are stored as volts, uncompressed.
+        """
+        x, y = calc.readPickleChannel(fileName, scope_chan)
+        x_zero, x_incr = x_axis_params(x)
+        try:
+            if preamble is None and byt_nr is not None:
+                preamble = codec.infer_preamble(y, byt_nr, x_incr)
+            if preamble is not None:
+                y = codec.to_codes(y, preamble)
+        except ValueError, e:
+            print >> sys.stderr, "Width %i stored as volts: %s" % (width, e)
+            preamble, encoding = None, "raw"
+        self.append(width, y, x_zero, x_incr, preamble, encoding)
+
+    def preamble(self, width):
+        """Return the scope preamble for a width, None if stored as volts"""
+        entry = self.index[int(width)]
+        if entry["YMULT"] == 0:
+            return None
+        return {"YMULT" : entry["YMULT"], "YOFF" : entry["YOFF"], "YZERO" : entry["YZERO"],
+                "XINCR" : entry["x_incr"], "BYT_NR" : np.dtype(entry["dtype"]).itemsize}
+
+    def read(self, width, traces=None, volts=False):
+        """Return the traces for a width.
+
+        Uncompressed widths come back as a read-only memory map, so only the
+        pages holding the selected traces (any numpy index) are read from
+        disk; compressed widths only decompress the blocks needed. Widths
+        stored as codes are returned as codes unless volts is set.
+        """
+        entry = self.index[int(width)]
+        preamble = self.preamble(width)
+        shape = (entry["n_traces"], entry["n_samples"])
+        if entry["encoding"] == "raw":
+            y = np.memmap(self.data_file, dtype=np.dtype(entry["dtype"]), mode='r',
+                          offset=entry["offset"], shape=shape)
+            if traces is not None:
+                y = y[traces]
+            if volts and preamble is not None:
+                return codec.to_volts(y, preamble)
+            return y
+        with open(self.data_file, 'rb') as data:
+            data.seek(entry["offset"])
+            blob = data.read(entry["n_bytes"])
+        return codec.decode(blob, shape[0], shape[1], entry["dtype"], entry["encoding"], traces,
+                            preamble=preamble, volts=volts and preamble is not None)
+
+    def read_x(self, width):
+        """Return the time axis for a width"""
+        entry = self.index[int(width)]
+        return entry["x_zero"] + entry["x_incr"]*np.arange(entry["n_samples"])
+
+
+def read_index(fileName):
+    """Read a store index file, returns dict of width -> entry"""
+    index = {}
+    if not os.path.isfile(fileName):
+        return index
+    with open(fileName, 'r') as file:
+        for line in file:
+            if line[0] == "#":
+                continue
+            bits = line.split()
+            if len(bits) == 7:
+                # Index written before codes were supported: volts, uncompressed
+                bits = bits + ["raw", "0", "0", "0", "0"]
+            if len(bits) != 12:
+                continue
+            index[int(bits[0])] = {"offset" : int(bits[1]), "n_traces" : int(bits[2]),
+                                   "n_samples" : int(bits[3]), "dtype" : bits[4],
+                                   "x_zero" : float(bits[5]), "x_incr" : float(bits[6]),
+                                   "encoding" : bits[7], "n_bytes" : int(bits[8]),
+                                   "YMULT" : float(bits[9]), "YOFF" : float(bits[10]),
+                                   "YZERO" : float(bits[11])}
+    return index
+
+def x_axis_params(x):
+    """Return (x_zero, x_incr) for a time axis as stored in the pickles"""
+    x = np.atleast_2d(x)[0]
+    if len(x) < 2:
+        return float(x[0]) if len(x) else 0., 0.
+    return float(x[0]), float(x[1] - x[0])
+
+def has_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_NAME))
+
+def index_stamp(path):
+    """(mtime, size) of a store's index file, to tell when it has changed;
+    None if there is no index yet
+    """
+    fileName = os.path.join(path, INDEX_NAME)
+    if not os.path.isfile(fileName):
+        return None
+    st = os.stat(fileName)
+    return st.st_mtime, st.st_size
+
+_stores = {}
+def open_store(path):
+    """Return a (per-process cached) store for a Channel_XX directory,
+    re-read if its index has changed since it was opened (e.g. widths
+    appended by a sweep that is still running)
+    """
+    key = os.path.abspath(path)
+    stamp = index_stamp(path)
+    if key not in _stores or _stores[key][0] != stamp:
+        _stores[key] = (stamp, WaveformStore(path))
+    return _stores[key][1]
+
+def convert_pickle_dir(path, scope_chan=1, remove=False, encoding="raw", byt_nr=None):
+    """Migrate every Width%05d.pkl in a Channel_XX directory into a store.
+    Widths already in the store are skipped. Returns the widths converted.
+    """
+    store = WaveformStore(path)
+    converted = []
+    for fileName in sorted(glob.glob(os.path.join(path, "Width*.pkl"))):
+        width = int(re.findall(r"Width(\d+)\.pkl", fileName)[0])
+        if width in store:
+            continue
+        store.append_pickle(width, fileName, scope_chan, encoding=encoding, byt_nr=byt_nr)
+        converted.append(width)
+        if remove:
+            os.remove(fileName)
+        print "Converted width %i" % width
+    return converted
+
+
+###############
+# MAIN FUNCTION
+###############
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] raw_data/Channel_XX/ [...]")
+    parser.add_option("--scope-chan", dest="scopeChan", type="int", default=1,
+                      help="Scope channel to take from the pickles")
+    parser.add_option("--remove", dest="remove", action="store_true", default=False,
+                      help="Delete each pickle once it is in the store")
+    parser.add_option("--codes", dest="bytNr", type="int", default=None,
+                      help="Store as 1 or 2 byte ADC codes instead of volts")
+    parser.add_option("--encoding", dest="encoding", default="raw",
+                      help="One of %s (compression needs --codes)" % ", ".join(codec.ENCODINGS))
+    (options,args) = parser.parse_args()
+
+    for path in args:
+        widths = convert_pickle_dir(path, options.scopeChan, options.remove, options.encoding, options.bytNr)
+        print "%s: %i widths converted" % (path, len(widths))
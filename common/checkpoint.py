@@ -0,0 +1,119 @@
+#####################################################
+# Resuming interrupted sweeps. The data files are
+# append-only, one row per width (width in the first
+# column), so they are their own checkpoint: read
+# back the rows that are complete and valid, sweep
+# only the missing widths, then rewrite the file in
+# width order with one row per width. Files are only
+# rewritten when a run is resumed, and every row
+# dropped is reported.
+#####################################################
+import os
+import numpy as np
+
+
+def read_rows(fileName, n_cols, header_lines=0, valid=None, dropped=None):
+    """Read a sweep data file.
+
+    The first header_lines lines, and any '#' comment lines, are kept as the
+    header. A row is kept if it has n_cols numeric, finite fields and passes
+    valid(width, values) if given; later rows for a width replace earlier
+    ones. If dropped is a list, (line number, reason) is appended to it for
+    every row left out. Returns (header lines, {width : row line}).
+    """
+    def drop(i, reason):
+        if dropped is not None:
+            dropped.append((i+1, reason))
+
+    header, rows, rows_line = [], {}, {}
+    if not os.path.isfile(fileName):
+        return header, rows
+    with open(fileName, 'r') as file:
+        lines = file.readlines()
+    for i, line in enumerate(lines):
+        if i < header_lines or line.startswith("#"):
+            header.append(line)
+            continue
+        if not line.strip():
+            continue
+        if not line.endswith("\n"):
+            # Last line cut short by a crash
+            drop(i, "incomplete line")
+            continue
+        bits = line.split()
+        if len(bits) != n_cols:
+            drop(i, "%i fields, expected %i" % (len(bits), n_cols))
+            continue
+        try:
+            values = np.array(bits, dtype=float)
+        except ValueError:
+            drop(i, "not numeric")
+            continue
+        if not np.all(np.isfinite(values)):
+            drop(i, "non-finite values")
+            continue
+        width = int(values[0])
+        if valid is not None and not valid(width, values):
+            drop(i, "width %i not valid" % width)
+            continue
+        if width in rows:
+            drop(rows_line[width], "width %i repeated on line %i" % (width, i+1))
+        rows[width] = line
+        rows_line[width] = i
+    return header, rows
+
+def remaining(widths, rows):
+    """Widths still to be measured, in sweep order"""
+    return [w for w in widths if int(w) not in rows]
+
+def write_ordered(fileName, header, rows):
+    """Rewrite a data file as its header then one row per width in width
+    order. Written to a temporary file first so a crash can't lose data.
+    """
+    tmpName = fileName + ".tmp"
+    with open(tmpName, 'w') as file:
+        file.writelines(header)
+        for width in sorted(rows.keys()):
+            file.write(rows[width])
+        file.flush()
+        os.fsync(file.fileno())
+    os.rename(tmpName, fileName)
+
+def compact(fileName, n_cols, header_lines=0, valid=None):
+    """Reduce a data file to its valid rows, ordered and one per width,
+    printing every row that was dropped and why. Only for resuming: the
+    file is rewritten. Returns the rows kept, as read_rows.
+    """
+    dropped = []
+    header, rows = read_rows(fileName, n_cols, header_lines, valid, dropped)
+    for line_no, reason in sorted(dropped):
+        print "%s: dropped line %i (%s)" % (fileName, line_no, reason)
+    write_ordered(fileName, header, rows)
+    return rows
+
+def format_conditions(conditions):
+    """Comment line recording a run's conditions, for files whose header
+    doesn't hold them already
+    """
+    return "#CONDITIONS\t" + "\t".join("%s=%r" % (key, conditions[key]) for key in sorted(conditions)) + "\n"
+
+def parse_conditions(header):
+    """Conditions dict from the header lines of a file, as format_conditions"""
+    for line in header:
+        if line.startswith("#CONDITIONS"):
+            return dict(bit.split("=", 1) for bit in line.rstrip("\n").split("\t")[1:])
+    return {}
+
+def check_conditions(old, new, tolerances):
+    """Compare the run conditions of an existing file with the current ones.
+    tolerances maps each key to the allowed absolute difference. Raises
+    ValueError listing every condition that differs.
+    """
+    bad = []
+    for key, tol in sorted(tolerances.items()):
+        if key not in old:
+            bad.append("%s missing from existing file" % key)
+        elif abs(float(old[key]) - float(new[key])) > tol:
+            bad.append("%s was %s, now %s" % (key, old[key], new[key]))
+    if bad:
+        raise ValueError("Cannot resume, run conditions changed: " + "; ".join(bad))
@@ -0,0 +1,121 @@
+#####################################################
+# On-disk cache of parsed data and analysis results.
+#
+# Results are stored as .npz files in a .cache/
+# directory next to the source data, keyed on the
+# sources (size, mtime and content hash for files;
+# size and mtime of every file for directories) and
+# the analysis parameters. The cache directory is
+# kept below a size limit by evicting the least
+# recently used entries.
+#####################################################
+import hashlib
+import json
+import os
+import numpy as np
+
+CACHE_DIR = ".cache"
+MAX_BYTES = 512*1024**2
+JSON_PREFIX = "json__"
+
+
+def file_hash(fileName, block=1024**2):
+    """sha1 of a file's content"""
+    sha = hashlib.sha1()
+    with open(fileName, 'rb') as file:
+        while True:
+            chunk = file.read(block)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def source_key(path):
+    """Identify the current state of a source file or directory.
+    Files are hashed; directories (e.g. raw_data/Channel_XX/, which can be
+    many GB) are identified by the size and mtime of every file in them.
+    """
+    if os.path.isdir(path):
+        listing = []
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != CACHE_DIR)
+            for name in sorted(files):
+                st = os.stat(os.path.join(root, name))
+                listing.append((os.path.relpath(os.path.join(root, name), path), st.st_size, st.st_mtime))
+        return ("dir", listing)
+    if not os.path.exists(path):
+        return ("missing", path)
+    st = os.stat(path)
+    return ("file", st.st_size, st.st_mtime, file_hash(path))
+
+def cache_key(sources, params):
+    """Key for a set of sources and a dict of analysis parameters"""
+    state = [source_key(src) for src in sources]
+    text = json.dumps([state, sorted(params.items())], sort_keys=True, default=str)
+    return hashlib.sha1(text).hexdigest()
+
+def save(fileName, result):
+    """Write a dict of arrays (and JSON-able values) to an .npz file"""
+    arrays = {}
+    for name, value in result.items():
+        if isinstance(value, np.ndarray):
+            arrays[name] = value
+        else:
+            arrays[JSON_PREFIX + name] = np.array(json.dumps(value))
+    tmpName = fileName + ".tmp.npz"
+    np.savez(tmpName, **arrays)
+    os.rename(tmpName, fileName)
+
+def load(fileName):
+    """Inverse of save"""
+    result = {}
+    with np.load(fileName) as data:
+        for name in data.files:
+            if name.startswith(JSON_PREFIX):
+                result[name[len(JSON_PREFIX):]] = json.loads(str(data[name]))
+            else:
+                result[name] = data[name]
+    return result
+
+def evict(cache_dir, max_bytes=MAX_BYTES):
+    """Delete least recently used entries until the cache fits in max_bytes"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npz"):
+            continue
+        fileName = os.path.join(cache_dir, name)
+        st = os.stat(fileName)
+        entries.append((st.st_mtime, st.st_size, fileName))
+    total = sum(e[1] for e in entries)
+    for mtime, size, fileName in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(fileName)
+        total -= size
+
+def cached(name, sources, params, compute, cache_dir=None, max_bytes=MAX_BYTES, enabled=True):
+    """Return compute(), a dict of results, re-using a cached copy when the
+    sources and params are unchanged since it was made.
+
+    name   -- label for the cache file
+    sources -- list of files/directories the result depends on
+    params  -- dict of analysis parameters the result depends on
+    """
+    if not enabled:
+        return compute()
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(sources[0])), CACHE_DIR)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    fileName = os.path.join(cache_dir, "%s_%s.npz" % (name, cache_key(sources, params)))
+    if os.path.isfile(fileName):
+        try:
+            result = load(fileName)
+            os.utime(fileName, None) # mark as recently used
+            return result
+        except (IOError, ValueError, KeyError):
+            os.remove(fileName)
+    result = compute()
+    save(fileName, result)
+    evict(cache_dir, max_bytes)
+    return result
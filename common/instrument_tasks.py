@@ -0,0 +1,128 @@
+#####################################################
+# Run blocking instrument and file I/O calls on
+# per-device worker threads so that calls to
+# different devices can overlap, while calls to
+# the same device stay strictly in order.
+#
+# Python 2 has no asyncio: submit() returns a Task
+# (a simple future) and the caller waits on it only
+# when it needs the result. An OverlapTrace records
+# when each call ran so the overlap achieved can be
+# reported.
+#####################################################
+import threading
+import Queue
+import time
+import sys
+
+
+class Task(object):
+    """Result of a call submitted to a DeviceWorker"""
+
+    def __init__(self, func, args, kwargs, label):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.label = label
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self.error = sys.exc_info()
+        self.done.set()
+
+    def result(self, timeout=None):
+        """Wait for the call to finish and return its value, re-raising
+        anything it raised.
+        """
+        if not self.done.wait(timeout) and not self.done.is_set():
+            raise RuntimeError("Timed out waiting for %s" % self.label)
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+
+class DeviceWorker(object):
+    """Executes calls for one device, in submission order, on its own thread"""
+
+    def __init__(self, name, trace=None, max_pending=0):
+        self.name = name
+        self.trace = trace
+        self.queue = Queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self._loop, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            start = time.time()
+            task.run()
+            if self.trace is not None:
+                self.trace.record(self.name, task.label, start, time.time())
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return its Task straight away"""
+        label = kwargs.pop("label", getattr(func, "__name__", "call"))
+        task = Task(func, args, kwargs, label)
+        self.queue.put(task)
+        return task
+
+    def close(self):
+        """Finish queued calls and stop the thread"""
+        self.queue.put(None)
+        self.thread.join()
+
+
+class OverlapTrace(object):
+    """Record of (device, label, start, end) for every call made"""
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def record(self, device, label, start, end):
+        with self.lock:
+            self.records.append((device, label, start, end))
+
+    def busy_time(self):
+        """Total time each device spent in calls, as a dict"""
+        busy = {}
+        for device, label, start, end in self.records:
+            busy[device] = busy.get(device, 0.) + (end - start)
+        return busy
+
+    def union_time(self):
+        """Time during which at least one device was busy"""
+        total, last_end = 0., None
+        for start, end in sorted((r[2], r[3]) for r in self.records):
+            if last_end is None or start > last_end:
+                total += end - start
+                last_end = end
+            elif end > last_end:
+                total += end - last_end
+                last_end = end
+        return total
+
+    def summary(self):
+        """Multi-line report of busy time per device and the overlap won"""
+        busy = self.busy_time()
+        serial = sum(busy.values())
+        union = self.union_time()
+        lines = ["%-12s busy %8.2f s" % (device, t) for device, t in sorted(busy.items())]
+        lines.append("Sequential I/O time %8.2f s, with overlap %8.2f s (saved %.2f s)" % (serial, union, serial - union))
+        return "\n".join(lines)
+
+    def write(self, fileName):
+        """Save the trace, times relative to its creation"""
+        with open(fileName, 'w') as file:
+            file.write("#DEVICE\tCALL\tSTART\tEND\n")
+            for device, label, start, end in self.records:
+                file.write("%s\t%s\t%.4f\t%.4f\n" % (device, label, start - self.start, end - self.start))
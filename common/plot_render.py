@@ -0,0 +1,132 @@
+#####################################################
+# Batch rendering of the analysis plots.
+#
+# A figure is a dict describing what to draw:
+#   {"file" : "results/x/GainVsIPW.png",
+#    "series" : [{"x" : ..., "y" : ..., "yerr" : ...,
+#                 "marker" : "x", "label" : ...}],
+#    "title" : ..., "xlabel" : ..., "ylabel" : ...,
+#    "xscale"/"yscale" : "log", "text" : ...,
+#    "legend" : loc, "style" : {"figsize" : ...}}
+# Series with "yerr" or "xerr" are drawn with
+# errorbar, the rest with plot; other series keys
+# are passed on to matplotlib.
+#
+# render() draws a list of figures with the Agg
+# backend in a process pool, skipping any whose
+# PNG exists and was made from the same data and
+# style (a hash of both is kept per directory in
+# .plot_hashes.json).
+#####################################################
+import hashlib
+import json
+import multiprocessing
+import os
+import numpy as np
+
+HASH_FILE = ".plot_hashes.json"
+RENDER_VERSION = 1      # bump when draw() changes what a figure looks like
+DEFAULT_STYLE = {"font.size" : 18, "figsize" : (10, 8), "dpi" : 80, "save_dpi" : 100}
+
+
+def figure_hash(figure):
+    """sha1 of a figure's data and style"""
+    sha = hashlib.sha1()
+    style = {"version" : RENDER_VERSION}
+    for key, value in sorted(figure.items()):
+        if key == "series":
+            for i, series in enumerate(value):
+                for name, item in sorted(series.items()):
+                    if isinstance(item, (np.ndarray, list, tuple)):
+                        item = np.ascontiguousarray(item)
+                        sha.update("%i/%s/%s/%s" % (i, name, item.dtype.str, item.shape))
+                        sha.update(item.tobytes())
+                    else:
+                        style["%i/%s" % (i, name)] = item
+        else:
+            style[key] = value
+    sha.update(json.dumps(style, sort_keys=True, default=str))
+    return sha.hexdigest()
+
+def read_hashes(dirName):
+    fileName = os.path.join(dirName, HASH_FILE)
+    if not os.path.isfile(fileName):
+        return {}
+    try:
+        with open(fileName, 'r') as file:
+            return json.load(file)
+    except ValueError:
+        return {}
+
+def write_hashes(dirName, hashes):
+    fileName = os.path.join(dirName, HASH_FILE)
+    with open(fileName + ".tmp", 'w') as file:
+        json.dump(hashes, file, sort_keys=True, indent=1)
+    os.rename(fileName + ".tmp", fileName)
+
+def draw(figure):
+    """Draw and save one figure with the Agg backend. Returns its file name."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    style = dict(DEFAULT_STYLE)
+    style.update(figure.get("style", {}))
+    matplotlib.rcParams.update({'font.size': style["font.size"]})
+    fig = plt.figure(figsize=style["figsize"], dpi=style["dpi"], facecolor='w')
+    axis = fig.gca()
+    for series in figure["series"]:
+        series = dict(series)
+        x, y = series.pop("x"), series.pop("y")
+        if "yerr" in series or "xerr" in series:
+            series.setdefault("fmt", '')
+            axis.errorbar(x, y, **series)
+        else:
+            axis.plot(x, y, series.pop("fmt", '-'), **series)
+    if "xscale" in figure:
+        axis.set_xscale(figure["xscale"])
+    if "yscale" in figure:
+        axis.set_yscale(figure["yscale"])
+    axis.set_title(figure.get("title", ""))
+    axis.set_xlabel(figure.get("xlabel", ""))
+    axis.set_ylabel(figure.get("ylabel", ""))
+    if figure.get("text"):
+        props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
+        axis.text(0.65, 0.95, figure["text"], transform=axis.transAxes, fontsize=14, verticalalignment='top',
+                  bbox=props)
+    if figure.get("legend"):
+        axis.legend(loc=figure["legend"])
+    fig.savefig(figure["file"], dpi=style["save_dpi"])
+    plt.close(fig)
+    return figure["file"]
+
+def render(figures, workers=1, force=False):
+    """Draw the figures that are out of date, in workers processes.
+    force redraws everything. Returns (files drawn, files skipped).
+    """
+    hashes, todo, skipped = {}, [], []
+    for figure in figures:
+        dirName = os.path.dirname(os.path.abspath(figure["file"]))
+        if dirName not in hashes:
+            hashes[dirName] = read_hashes(dirName)
+        key = figure_hash(figure)
+        name = os.path.basename(figure["file"])
+        if not force and hashes[dirName].get(name) == key and os.path.isfile(figure["file"]):
+            skipped.append(figure["file"])
+            continue
+        todo.append((figure, dirName, name, key))
+    if workers > 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(min(workers, len(todo)))
+        try:
+            drawn = pool.map(draw, [t[0] for t in todo])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        drawn = [draw(t[0]) for t in todo]
+    changed = set()
+    for figure, dirName, name, key in todo:
+        hashes[dirName][name] = key
+        changed.add(dirName)
+    for dirName in changed:
+        write_hashes(dirName, hashes[dirName])
+    return drawn, skipped
@@ -0,0 +1,72 @@
+#####################################################
+# Reader for the power-meter data files written by
+# power_meter/PowerCal.py, shared by all scripts.
+#
+# First line is the header:
+#   wavelength pulse_sep rate temperature pedestal
+# followed by one row per IPW width:
+#   width PIN PIN_rms photons photon_err watts watt_err
+# (older files have no PIN_rms column).
+#####################################################
+import numpy as np
+import data_cache
+
+DTYPE = np.dtype([("width", np.int64), ("pin", np.int64), ("pin_rms", np.float64),
+                  ("photons", np.float64), ("photon_err", np.float64),
+                  ("watts", np.float64), ("watt_err", np.float64)])
+
+# File columns -> fields, keyed on number of columns
+COLUMNS = {7 : ("width", "pin", "pin_rms", "photons", "photon_err", "watts", "watt_err"),
+           6 : ("width", "pin", "photons", "photon_err", "watts", "watt_err")}
+
+
+def parse_header(line):
+    """Return the header line of a power-meter file as a dict"""
+    tmp = line.split()
+    return {"Wavelength" : int(tmp[0]), "Pulse sep" : float(tmp[1]), "Rate" : int(tmp[2]), "Temp" : float(tmp[3]), "Pedestal" : float(tmp[4]) }
+
+def read_header(fileName):
+    """Read only the header of a power-meter file"""
+    with open(fileName, 'r') as file:
+        return parse_header(file.readline())
+
+def read_power_meter_file(fileName):
+    """Read a power-meter file in a single pass.
+    Returns (header dict, structured array with the fields in DTYPE).
+    """
+    with open(fileName, 'r') as file:
+        header = parse_header(file.readline())
+        text = file.read()
+    return header, parse_rows(text, fileName)
+
+def parse_rows(text, fileName="<string>"):
+    """Parse the data rows of a power-meter file into a structured array"""
+    text = text.strip()
+    if not text:
+        return np.zeros(0, dtype=DTYPE)
+    end = text.find("\n")
+    noCol = len(text[:end if end >= 0 else None].split())
+    if noCol not in COLUMNS:
+        raise ValueError("%s: unexpected number of columns (%i)" % (fileName, noCol))
+    values = np.fromstring(text, sep=" ")
+    # fromstring stops quietly at the first bad value, so check every data
+    # line was read in full
+    noRows = sum(1 for line in text.splitlines() if line.strip())
+    if values.size != noRows*noCol:
+        raise ValueError("%s: read %i values from %i rows of %i columns; malformed row?" % (
+                         fileName, values.size, noRows, noCol))
+    values = values.reshape(-1, noCol)
+    data = np.zeros(len(values), dtype=DTYPE)
+    for i, name in enumerate(COLUMNS[noCol]):
+        data[name] = values[:,i]
+    return data
+
+def load_power_meter_file(fileName, use_cache=True):
+    """As read_power_meter_file, re-using a parsed copy from the data cache
+    when the file is unchanged.
+    """
+    def parse():
+        header, data = read_power_meter_file(fileName)
+        return {"header" : header, "data" : data}
+    result = data_cache.cached("power_meter", [fileName], {}, parse, enabled=use_cache)
+    return result["header"], result["data"]
@@ -0,0 +1,41 @@
+#####################################################
+# Array level photon scaling and gain calculation,
+# with error propagation.
+#
+# All functions take whole columns and broadcast,
+# so a leading batch axis (voltages, channels, ...)
+# can be used to compute many scans in one call,
+# e.g. watts of shape (n_volts, n_widths) with a
+# pulse separation of shape (n_volts, 1).
+#####################################################
+import numpy as np
+
+PLANCK = 6.626e-34   # J s
+LIGHT_SPEED = 3e8    # m / s
+E_CHARGE = 1.6e-19   # C
+
+
+def photon_energy(wavelength):
+    """Photon energy (J) for a wavelength in nm"""
+    return (PLANCK * LIGHT_SPEED) / (np.asarray(wavelength, dtype=float)*1e-9)
+
+def photon_scaling(watts, wattsErr, wavelength, pulse_sep):
+    """Convert power readings (W) to photons per pulse"""
+    scale = np.asarray(pulse_sep, dtype=float) / photon_energy(wavelength)
+    return np.asarray(watts)*scale, np.asarray(wattsErr)*scale
+
+def scaling(rawArr, rawErr, header):
+    """photon_scaling using the conditions in a power-meter file header"""
+    return photon_scaling(rawArr, rawErr, header["Wavelength"], header["Pulse sep"])
+
+def calc_gain(area, areaErr, photons, photonsErr):
+    """Gain and its error from pulse area and photons per pulse.
+    Entries with zero area are masked out and returned as zero.
+    """
+    area, areaErr, photons, photonsErr = np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in
+                                                               (area, areaErr, photons, photonsErr)])
+    valid = area != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain = np.abs(area) / (photons*E_CHARGE)
+        gainErr = np.abs(gain)*np.sqrt( (areaErr/area)**2 + (photonsErr/photons)**2 )
+    return np.where(valid, gain, 0.), np.where(valid, gainErr, 0.)
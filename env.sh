@@ -1 +1 @@
-export PYTHONPATH=$PYTHONPATH:../tellie:../AcquireTek:../TELLIE_calibration_code
\ No newline at end of file
+export PYTHONPATH=$PYTHONPATH:../tellie:../AcquireTek:../TELLIE_calibration_code:./common
\ No newline at end of file
@@ -5,49 +5,16 @@
 # Author: Ed Leming
 # Date: 18/10/2014
 #####################################################
-import ROOT
-from ROOT import kRed, kBlue, kWhite
-import time
+# ROOT is only imported when plotting (see main), --json runs without it
+import sys
+import json
+import optparse
 #import matplotlib.pyplot as plt
 import numpy as np
-
-def readHeader(fileName):
-
-    # Open file, read only the first line
-    with open(fileName, 'r') as file:
-        header = file.readline()
-    tmp = header.split(" ")
-
-    # Return as dict.
-    return {"Wavelength" : int(tmp[0]), "Pulse sep" : float(tmp[1]), "Rate" : int(tmp[2]), "Temp" : float(tmp[3]), "Pedestal" : float(tmp[4]) }
-
-def readData(fileName):
-
-    # Find no. of lines
-    noLin = sum(1 for line in open(fileName)) - 1  ###-1 to correct for header
-
-    # Define new arrays
-    widths, PIN, PINErr = np.zeros(noLin), np.zeros(noLin), np.zeros(noLin)
-    photons, photonErr = np.zeros(noLin), np.zeros(noLin)
-    watts, wattsErr = np.zeros(noLin), np.zeros(noLin)
-    
-    # Open file
-    c = 0
-    with open(fileName, 'r') as file:
-        next(file)
-        for line in file:
-            tmp = line.split(" ")
-            widths[c] = int(tmp[0])
-            PIN[c] = int(tmp[1])
-            #PINErr[c] = float(tmp[2])
-            photons[c] = int(tmp[2])
-            photonErr[c] = int(tmp[3])
-            watts[c] = float(tmp[4])
-            wattsErr[c] = float(tmp[5])
-            c=c+1
-
-    # return filled lists
-    return widths, PIN, PINErr, watts, wattsErr
+import pm_data
+import pmt_gain
+import piecewise_fit
+import plot_render
 
 def plotXY(x,y):
     """Return TGraph of x, y data sets"""
@@ -59,7 +26,6 @@ def plotXY(x,y):
     #plot.GetYaxis().SetRangeUser(-1e-12,2.5e-7)
     plot.GetXaxis().SetRangeUser(0,max(x))
     tc.Modified(); tc.Update()
-    time.sleep(5)
     return plot
 
 def plotErr(x, y, yErr, xErr=None):
@@ -87,13 +53,10 @@ def fitFunc(x, par):
 
 def fitFunc1(x, par):
     if(x[0] <= 7100):
-        print x[0]
         return pol1(x,par[0],par[1])
     if(7100 < x[0] and x[0] <= 7700):
-        print x[0]
         return pol2(x,par[2],par[3],par[4])
     if(x[0] > 7700):
-        print x[0], par[5], par[6]
         return pol1(x,par[5],par[6])
 
 def lineExpFit(plot):
@@ -139,19 +102,47 @@ def lineExpFit(plot):
 
     return pT
 
-def scaling(rawArr, rawErr, header):
-    
-    # New arrays
-    scaledArr, scaledErr = np.zeros( len(rawArr) ), np.zeros( len(rawArr) )
-
-    # Calculate photon energy (J)
-    ePh = (6.626e-34 * 3e8) / (header["Wavelength"]*1e-9)
-    
-    for i, val in enumerate(rawArr):
-        # Calculate no of photons
-        scaledArr[i] = (rawArr[i]*header["Pulse sep"]) / ePh
-        scaledErr[i] = (rawErr[i]*header["Pulse sep"]) / ePh
-    return scaledArr, scaledErr
+def numpyFit(x, y, yErr, lo, hi, saveName, verbose=True):
+    """Fit the linear-quadratic-linear curve (free breakpoints) over [lo, hi]
+    with piecewise_fit, print the parameters and save the curve with its
+    95% band to saveName. Returns (params, covariance, intervals, curve x, y).
+    """
+    sel = (x >= lo) & (x <= hi)
+    sigma = yErr[sel] if np.all(yErr[sel] > 0) else None
+    pars, cov = piecewise_fit.fit(x[sel], y[sel], sigma, absolute_sigma=sigma is not None)
+    intervals = piecewise_fit.param_intervals(pars, cov, np.count_nonzero(sel))
+    for name, par, err, (cl_lo, cl_hi) in zip(piecewise_fit.PARAMS, pars, np.sqrt(np.diag(cov)), intervals):
+        if verbose:
+            print "%-3s = %.5e +/- %.2e  (95%%: %.5e, %.5e)" % (name, par, err, cl_lo, cl_hi)
+    fit_x = np.linspace(lo, hi, 500)
+    fit_y, band_lo, band_hi = piecewise_fit.confidence_band(fit_x, pars, cov, np.count_nonzero(sel))
+    np.savetxt(saveName, np.column_stack((fit_x, fit_y, band_lo, band_hi)), header="WIDTH\tFIT\tCL95_LO\tCL95_HI")
+    return pars, cov, intervals, fit_x, fit_y
+
+def drawCurve(x, y):
+    """Draw a fitted curve over the current plot"""
+    curve = ROOT.TGraph(len(x), x, y)
+    curve.SetLineColor(ROOT.kRed)
+    curve.Draw("l same")
+    tc.Modified(); tc.Update()
+    return curve
+
+def renderPlots(widths, photons, photonErr, PIN, PINErr, fit_x=None, fit_y=None, workers=1, force=False):
+    """The three plots drawn with matplotlib through plot_render rather than
+    ROOT, skipping any whose data are unchanged. Returns (drawn, skipped).
+    """
+    photonSeries = [{"x" : widths, "y" : photons, "yerr" : photonErr, "marker" : '.', "linestyle" : ''}]
+    if fit_x is not None:
+        photonSeries.append({"x" : fit_x, "y" : fit_y, "fmt" : '-', "color" : 'r'})
+    figures = [{"file" : "./power_meter/results/PhotonsVsWidth.png", "series" : photonSeries, "yscale" : "log",
+                "title" : "PhotonsVsWidth", "xlabel" : "LED pulse width (14 bit)", "ylabel" : "No. Photons"},
+               {"file" : "./power_meter/results/PINVsWidth.png",
+                "series" : [{"x" : widths, "y" : PIN, "yerr" : PINErr, "marker" : '.', "linestyle" : ''}],
+                "title" : "PINVsWidth", "xlabel" : "LED pulse width (14 bit)", "ylabel" : "PIN reading (14 bit)"},
+               {"file" : "./power_meter/results/PINVsPhotons.png",
+                "series" : [{"x" : photons, "y" : PIN, "xerr" : photonErr, "marker" : '.', "linestyle" : ''}],
+                "title" : "PINVsPhotons", "xlabel" : "No. Photons", "ylabel" : "PIN reading (14 bit)"}]
+    return plot_render.render(figures, workers, force)
 
 def calcSettings(p, noPh):
     return 0
@@ -161,19 +152,62 @@ def calcSettings(p, noPh):
 # MAIN FUNCTION
 ###############
 if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--fit", dest="fit", default="none",
+                      help="Fit photons vs. width: none, root (lineExpFit) or numpy (piecewise_fit)")
+    parser.add_option("--range", dest="fitRange", default="6600:8200",
+                      help="Width range fitted, as lo:hi")
+    parser.add_option("--json", dest="jsonFile", default=None,
+                      help="Numbers only: write photons (and the numpy fit) as json to this file ('-' for stdout), no ROOT")
+    parser.add_option("--mpl", dest="mpl", action="store_true", default=False,
+                      help="Draw the plots with matplotlib (plot_render) instead of ROOT, skipping unchanged ones")
+    parser.add_option("--replot", dest="replot", action="store_true", default=False,
+                      help="With --mpl, redraw every plot even if its data are unchanged")
+    parser.add_option("-j", dest="workers", type="int", default=1, help="With --mpl, plots drawn concurrently")
+    (options,args) = parser.parse_args()
 
     #fileName = "./data/pin_calib_Run2.dat"
     fileName = "./data/pin_calib_TellieRange.dat"
 
     # Read file
-    header = readHeader(fileName)
-    print header["Wavelength"]
-    widths, PIN, PINErr, watts, wattsErr = readData(fileName)
+    header, pm = pm_data.load_power_meter_file(fileName)
+    # ROOT wants contiguous double arrays
+    widths, PIN, PINErr, watts, wattsErr = [np.array(pm[f], dtype=float) for f in ("width", "pin", "pin_rms", "watts", "watt_err")]
 
     # Scale power values to give photons
-    photons, photonErr = scaling(watts, wattsErr, header)
+    photons, photonErr = pmt_gain.scaling(watts, wattsErr, header)
+    fit_lo, fit_hi = [float(b) for b in options.fitRange.split(":")]
+
+    if options.jsonFile:
+        summary = {"file" : fileName, "width" : widths.tolist(), "photons" : photons.tolist(),
+                   "photons_err" : photonErr.tolist(), "pin" : PIN.tolist(), "pin_err" : PINErr.tolist()}
+        if options.fit == "numpy":
+            pars, cov, intervals, fit_x, fit_y = numpyFit(widths, photons, photonErr, fit_lo, fit_hi,
+                                                          "./power_meter/results/PhotonsVsWidth_fit.dat", False)
+            summary["fit"] = dict(zip(piecewise_fit.PARAMS, pars.tolist()))
+            summary["fit_cov"] = cov.tolist()
+            summary["fit_cl95"] = dict(zip(piecewise_fit.PARAMS, intervals.tolist()))
+        if options.jsonFile == "-":
+            json.dump(summary, sys.stdout, sort_keys=True)
+            print
+        else:
+            with open(options.jsonFile, 'w') as json_file:
+                json.dump(summary, json_file, sort_keys=True, indent=1)
+        sys.exit(0)
+
+    print header["Wavelength"]
+    if options.mpl:
+        fit_x = fit_y = None
+        if options.fit == "numpy":
+            pars, cov, intervals, fit_x, fit_y = numpyFit(widths, photons, photonErr, fit_lo, fit_hi,
+                                                          "./power_meter/results/PhotonsVsWidth_fit.dat")
+        drawn, skipped = renderPlots(widths, photons, photonErr, PIN, PINErr, fit_x, fit_y,
+                                     options.workers, options.replot)
+        print "Drew %i plots, %i up to date" % (len(drawn), len(skipped))
+        sys.exit(0)
 
     # ROOT stuff
+    import ROOT
     tc = ROOT.TCanvas("c1","c1",800,600)
     tc.SetLogy()
 
@@ -186,7 +220,12 @@ if __name__ == "__main__":
     tmpPlot.GetYaxis().SetTitle("No. Photons")
     #tmpPlot.GetYaxis().SetRangeUser(0.5e4,1e6)
     #tmpPlot.GetXaxis().SetRangeUser(6000,8000)
-    #pars = lineExpFit(tmpPlot)
+    if options.fit == "root":
+        pars = lineExpFit(tmpPlot)
+    elif options.fit == "numpy":
+        pars, cov, intervals, fit_x, fit_y = numpyFit(widths, photons, photonErr, fit_lo, fit_hi,
+                                                      "./power_meter/results/%s_fit.dat" % name)
+        curve = drawCurve(fit_x, fit_y)
     tc.Update()
     saveName = "./power_meter/results/%s.png" % (name)
     tc.SaveAs(saveName)
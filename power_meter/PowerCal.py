@@ -9,21 +9,32 @@
 import threading
 import time
 import sys
+import os
 import visa
 import serial
 import math
+import optparse
 import numpy as np
 from array import *
+import pm100
+import ring_buffer
+import checkpoint
+import pm_data
 # Visa imports
 from pyvisa.vpp43 import visa_library
 visa_library.load_library("/Library/Frameworks/VISA.framework/VISA")
 # Tellie imports
 from core import serial_command
 
+# width, pin, pin_rms, photons, photon_err, watts, watt_err
+ROW_FORMAT = "%i %i %1.2f %i %i %1.7e %1.2e \n"
+
 
 class Power_Meter(threading.Thread):
     
-    def __init__(self, threadID, name, wavelength, pulse_separation, fileName):
+    def __init__(self, threadID, name, wavelength, pulse_separation, fileName,
+                 rel_err=None, min_samples=3, max_samples=4, fast=False, ring=None, window=4.0,
+                 resume=False, temp_tol=2.0, abs_err=None):
         #-- Definitions
         threading.Thread.__init__(self)
         self.threadID = threadID
@@ -31,9 +42,17 @@ class Power_Meter(threading.Thread):
         self.pulse_separation = pulse_separation
         self.exit_flag = 0
         self.wavelength = wavelength
+        # Statistical stopping for read(), see there
+        self.rel_err = rel_err
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.abs_err = abs_err
+        # Streaming of timestamped readings into a SampleRing, see stream()
+        self.ring = ring
+        self.window = window
+        self.fast = fast
         
-        wait = 0.25         # Wait call, in s
-        pW    = 1e-12       # 1 pico Watt
+        wait = 0.25         # Wait call, in s (not used with fast set-up)
         
         ####################
         # INSTRUMENT SET-UP
@@ -42,46 +61,23 @@ class Power_Meter(threading.Thread):
         #self.power_meter = visa.instrument("USB0::0x1313::0x8072::P2000781::0") # Leeds
         self.power_meter   = visa.instrument("USB0::0x1313::0x8072::P2001877::0") # Sussex
         
-        time.sleep(wait);   self.power_meter.write("*RST")
-        time.sleep(wait);   print "Info: Instrument ID:",   self.power_meter.ask("*IDN?")
-        time.sleep(wait);   print "Info: Self test status:",self.power_meter.ask("*TST?")
-        time.sleep(wait);   print "Info: System version: ", self.power_meter.ask("SYSTEM:VERSION?")
-        time.sleep(wait);   response = self.power_meter.ask("SYSTEM:SENSOR:IDN?"); list = response.split(","); print "Info: Sensor ID is ",list[0];
-
-        time.sleep(wait);   self.power_meter.write("CONFIGURE:SCALAR:TEMPERATURE")
-        time.sleep(wait);   temperature = float(self.power_meter.ask("READ?")); print "Info: Sensor temperature is %.1f Celsius" % temperature
-
-        time.sleep(wait);   self.power_meter.write("CONFIGURE:SCALAR:POWER")
-        time.sleep(wait);   self.power_meter.write("POWER:DC:UNIT W")
-        time.sleep(wait);   print "Info: Unit for DC power is now : ",self.power_meter.ask("POWER:DC:UNIT?")
-
-        time.sleep(wait);   self.power_meter.write("SENSE:CORRECTION:WAVELENGTH "+str(int(wavelength)))
-        time.sleep(wait);   nm = float(self.power_meter.ask("SENSE:CORRECTION:WAVELENGTH?")); print "Info: Wavelength now set to [nm]: ",int(nm)
-        time.sleep(wait);   self.power_meter.write("SENSE:AVERAGE:COUNT 3000")
-        time.sleep(wait);   counts = int(self.power_meter.ask("SENSE:AVERAGE:COUNT?")); print "Info: Samples per average pre zero adjustment: ",int(counts)
-
-        time.sleep(wait);   print "Info: Configuration is set to : ", self.power_meter.ask("CONFIGURE?")
-        time.sleep(wait);   print "Info: Power auto range status : ", self.power_meter.ask("POWER:RANGE:AUTO?")
-        
-        #-- zero suppression
-        for n in range(0, 1) :
-            time.sleep(wait); self.power_meter.write("SENSE:CORRECTION:COLLECT:ZERO:INITIATE")
-            state = 1
-            while state > 0 :
-                time.sleep(wait);  state = int(self.power_meter.ask("SENSE:CORRECTION:COLLECT:ZERO:STATE?"))
-                print "Info: Zero adjustment (1=waiting, 0=done) : %s" % (state)
-            else:
-                ped = float(self.power_meter.ask("SENSE:CORRECTION:COLLECT:ZERO:MAGNITUDE?"))
-                time.sleep(wait); print "Info: Pedestal [pW] : %s" % (ped/pW)
-        
-        #-- reduce counts per average (1 count takes 2 ms)
-        counts = 500
-        cmd = "SENSE:AVERAGE:COUNT %i " % counts
-        time.sleep(wait); self.power_meter.write(cmd)
-        time.sleep(wait); counts = int(self.power_meter.ask("SENSE:AVERAGE:COUNT?"))
-        print "Info: Samples per average post zero adjustment: %i" % (int(counts))
+        self.pm = pm100.PM100(self.power_meter, None if fast else wait)
+        temperature, ped = self.pm.setup(wavelength)
+        if fast:
+            # Keep the meter averaging between fetches
+            self.sample = self.pm.read_pipelined
+            self.pm.initiate()
+        else:
+            self.sample = self.pm.read
     
-        #-- Save header to file
+        #-- Save header to file, or check it matches when resuming a sweep
+        if resume and os.path.isfile(fileName):
+            checkpoint.check_conditions(pm_data.read_header(fileName),
+                                        {"Wavelength" : wavelength, "Pulse sep" : pulse_separation,
+                                         "Temp" : temperature},
+                                        {"Wavelength" : 0, "Pulse sep" : 1e-2*pulse_separation,
+                                         "Temp" : temp_tol})
+            return
         data = open(fileName,"w")
         rate=1./pulse_separation
         dataStr = "%i %1.2e %i %2.1f %3.3e \n" % (wavelength, pulse_separation, rate, temperature, ped)
@@ -90,36 +86,83 @@ class Power_Meter(threading.Thread):
 
     def run(self):
         print "Info: Starting " + self.name
-        global ppp_value, ppp_error, Watt_value, Watt_error
+        if self.ring is not None:
+            self.stream()
+            print "Info: Exiting " + self.name
+            return
+        global ppp_value, ppp_error, Watt_value, Watt_error, read_count
         p_dict = {}
         while self.exit_flag < 1 :
             with LOCK:
-                p_dict = self.read()
+                if self.rel_err is None:
+                    p_dict = self.read()
+                else:
+                    p_dict = self.read(rel_err=self.rel_err, min_samples=self.min_samples, max_samples=self.max_samples,
+                                       abs_err=self.abs_err)
                 ppp_value = p_dict["photons"]
                 ppp_error = p_dict["error"]
                 Watt_value = p_dict["Watts"]
                 Watt_error = p_dict["Watt_error"]
+                read_count = read_count + 1
             time.sleep(0.1)
         print "Info: Exiting " + self.name
 
-    def read(self, sample_time=4.0) :
+    def stream(self):
+        """Push every reading into the ring buffer with the time span it was
+        measured over. Pipelined readings cover the time since the previous
+        fetch, when the measurement was initiated.
+        """
+        t_end = time.time()
+        while self.exit_flag < 1 :
+            t_start = t_end if self.fast else time.time()
+            power = self.sample()
+            t_end = time.time()
+            self.ring.push(t_start, t_end, power)
+
+    def read(self, sample_time=4.0, rel_err=None, min_samples=3, max_samples=None, abs_err=None) :
+        """Average READ? samples from the power meter.
+
+        By default samples are taken for a fixed sample_time. If rel_err is
+        given, sampling instead stops as soon as the relative standard error
+        on the mean falls below rel_err, or the standard error itself falls
+        below abs_err (W, the meter's noise: dark readings average to ~0 and
+        never reach rel_err), after at least min_samples, or at max_samples
+        (each READ? takes ~1 s). A running (Welford) mean and variance is kept, and the
+        number of samples and precision reached are returned too.
+        """
         global width
         pW    = 1e-12
-        power = []
+        n, mean, m2 = 0, 0., 0.
+        sem = float('inf')
         start = time.time()                                             # start clock for OFF time
-        while  (time.time() < (start + sample_time)):
-            power.append(float(self.power_meter.ask("READ?")))          # start measurement; when finished read average power
-        if len(power) < 3 :
-            print "Warning: Only %i power measurements made." % power.size
-        power_avg = np.mean(power)
-        power_rms = np.std(power)
-        del power
+        while True:
+            power = self.sample()                                       # start measurement; when finished read average power
+            n = n + 1
+            delta = power - mean
+            mean = mean + delta / n
+            m2 = m2 + delta*(power - mean)
+            if n > 1:
+                sem = math.sqrt(m2 / (n-1) / n)
+            if max_samples is not None and n >= max_samples:
+                break
+            if rel_err is None:
+                if time.time() >= (start + sample_time):
+                    break
+            elif n >= min_samples and ((mean != 0 and sem/abs(mean) < rel_err) or
+                                       (abs_err is not None and sem < abs_err)):
+                break
+        if n < 3 :
+            print "Warning: Only %i power measurements made." % n
+        power_avg = mean
+        power_rms = math.sqrt(m2 / n)
+        achieved = sem/abs(mean) if mean != 0 else float('inf')
         Watt_value = power_avg
         Watt_error = power_rms
         ppp_value = self.photon_conversion(power_avg)
         ppp_error = self.photon_conversion(power_rms)
-        print "Info: Watts %1.4e +/- %1.2e : Photons per pulse %1.4e +/- %1.2e, width %i" % (Watt_value, Watt_error, ppp_value, ppp_error, width)
-        return { "Watts" : Watt_value , "Watt_error" : Watt_error, "photons" : ppp_value , "error" : ppp_error  }
+        print "Info: Watts %1.4e +/- %1.2e : Photons per pulse %1.4e +/- %1.2e, width %i (%i samples, rel. err. on mean %1.1e, %1.1f s)" % (Watt_value, Watt_error, ppp_value, ppp_error, width, n, achieved, time.time()-start)
+        return { "Watts" : Watt_value , "Watt_error" : Watt_error, "photons" : ppp_value , "error" : ppp_error,
+                 "samples" : n, "rel_err" : achieved }
 
     def photon_conversion(self, power):
         '''Convert a power value to number of photons
@@ -129,11 +172,173 @@ class Power_Meter(threading.Thread):
         return no_photons
 
 
+def integrate_power():
+    """Wait for the power meter reading at the light level just set.
+    Returns (photons, photon_err, watts, watt_err).
+    """
+    if power_meter.ring is not None:
+        # Only use readings taken wholly after the light level changed,
+        # integrating for the window or until the mean has converged
+        t0 = time.time()
+        while True:
+            time.sleep(0.05)
+            tmpWatt, tmpWattErr, n = power_meter.ring.window(t0)
+            if time.time() - t0 >= power_meter.window:
+                break
+            if power_meter.rel_err is not None and n >= max(power_meter.min_samples, 2):
+                sem = tmpWattErr/math.sqrt(n-1)
+                if (tmpWatt != 0 and sem/abs(tmpWatt) < power_meter.rel_err) or \
+                   (power_meter.abs_err is not None and sem < power_meter.abs_err):
+                    break
+        if n < 3 :
+            print "Warning: Only %i power measurements made." % n
+        tmpPPP = power_meter.photon_conversion(tmpWatt)
+        tmpPPPErr = power_meter.photon_conversion(tmpWattErr)
+    else:
+        if power_meter.rel_err is None:
+            time.sleep(8)
+        else:
+            # The read in progress when the light changed is stale; wait for
+            # the one after it to converge.
+            count = read_count
+            while read_count < count + 2:
+                time.sleep(0.05)
+        tmpPPP = ppp_value
+        tmpPPPErr = ppp_error
+        tmpWatt = Watt_value
+        tmpWattErr = Watt_error
+        time.sleep(1)
+    return tmpPPP, tmpPPPErr, tmpWatt, tmpWattErr
+
+def read_back_pin(sc, channel):
+    """Fire a sequence and return the channel's PIN reading and rms"""
+    with LOCK:
+        sc.fire_sequence()
+        #time.sleep(1)
+        pin = None
+        while pin==None:
+            pin, rms, _ = sc.tmp_read_rms()
+    return int(pin[channel]), float(rms[channel])
+
+def record_row(data, row):
+    """Write a (width, pin, pin_rms, photons, photon_err, watts, watt_err)
+    row to the data file and print it
+    """
+    try:
+        dataStr = ROW_FORMAT % row
+        data.write(dataStr)
+        data.flush()
+    except:
+        print "ERROR WITH DATA WRITING"
+        power_meter.exit_flag = 1
+
+    # Print results
+    print "*********** DATA FOR WIDTH: %4i ************" % (row[0])
+    outStr = "Width: \t\t%i \nPIN: \t\t%i +/- %1.1f \nPhoton no.: \t%1.4e +/- %1.1e \nWatts: \t\t%1.4e +/- %1.1e" % row
+    print outStr
+    print "*********************************************"
+    print ""
+
+def measure_width(sc, channel, data, new_width):
+    """Fire TELLIE continuously at one width, record the power meter and PIN
+    readings to the data file and return them as a tuple
+    (width, pin, pin_rms, photons, photon_err, watts, watt_err).
+    """
+    global width
+    width = new_width
+    sc.set_pulse_width(width)
+    time.sleep(0.1)
+    sc.fire_continuous()
+    power = integrate_power()
+    sc.stop()
+    row = (width,) + read_back_pin(sc, channel) + power
+    record_row(data, row)
+    return row
+
+def adaptive_sweep(measure, start, stop, coarse_step, fine_step, refine_frac=0.05, sat_tol=0.02, sat_points=2,
+                   n_sigma=3.):
+    """Sweep widths coarsely, then refine where photons per pulse change fastest.
+
+    measure(width) must return a row as from measure_width. The coarse pass
+    stops early once the curve has turned on and then flattened out (sat_points
+    steps in a row changing by less than sat_tol) i.e. at saturation. Coarse
+    intervals whose change in photons is at least refine_frac of the largest
+    change (or that at least halve/double, as where the light turns on) are
+    then re-measured every fine_step. Only changes larger than n_sigma times
+    the readings' combined photon errors count, so noise on the dark widths
+    neither turns the curve on nor gets refined. Returns {width : row}.
+    """
+    rows = {}
+    coarse = range(start, stop, coarse_step)
+    turned_on, flat = False, 0
+    for i, w in enumerate(coarse):
+        rows[w] = measure(w)
+        if i == 0:
+            continue
+        prev, this = rows[coarse[i-1]][3], rows[w][3]
+        change = abs(this - prev) / max(abs(this), abs(prev), 1.)
+        significant = abs(this - prev) > n_sigma*math.hypot(rows[coarse[i-1]][4], rows[w][4])
+        if change > 10*sat_tol and significant:
+            turned_on = True
+        flat = flat + 1 if (turned_on and change < sat_tol) else 0
+        if flat >= sat_points:
+            print "Info: photons flat for %i steps, stopping coarse pass at width %i" % (flat, w)
+            break
+    done = sorted(rows.keys())
+    photons = np.array([rows[w][3] for w in done], dtype=float)
+    errors = np.array([rows[w][4] for w in done], dtype=float)
+    deltas = np.abs(np.diff(photons))
+    if len(deltas) == 0 or deltas.max() == 0:
+        return rows
+    rel = deltas / np.maximum(np.maximum(np.abs(photons[1:]), np.abs(photons[:-1])), 1.)
+    significant = deltas > n_sigma*np.hypot(errors[1:], errors[:-1])
+    refine = significant & ((deltas >= refine_frac*deltas.max()) | ((rel >= 0.5) & (deltas >= 1e-3*deltas.max())))
+    for lo, hi, ok in zip(done[:-1], done[1:], refine):
+        if not ok:
+            continue
+        for w in range(lo + fine_step, hi, fine_step):
+            rows[w] = measure(w)
+    return rows
+
+def parse_row(line):
+    """Row tuple, as returned by measure_width, from a line of the data file"""
+    bits = line.split()
+    return (int(bits[0]), int(bits[1]), float(bits[2])) + tuple(float(b) for b in bits[3:])
+
 ##########################
 #   MAIN FUNCTION
 ##########################
 if __name__ == "__main__":
-    
+    parser = optparse.OptionParser()
+    parser.add_option("--adaptive", dest="adaptive", action="store_true", default=False,
+                      help="Coarse sweep, then refine where the light level changes fastest")
+    parser.add_option("--start", dest="start", type="int", default=0, help="First width")
+    parser.add_option("--stop", dest="stop", type="int", default=9000, help="Sweep up to (not including) this width")
+    parser.add_option("--step", dest="step", type="int", default=100, help="Step for the uniform sweep")
+    parser.add_option("--coarse-step", dest="coarseStep", type="int", default=400,
+                      help="Step for the adaptive coarse pass")
+    parser.add_option("--fine-step", dest="fineStep", type="int", default=100,
+                      help="Step used where the adaptive sweep refines")
+    parser.add_option("--rel-err", dest="relErr", type="float", default=None,
+                      help="Stop each power reading once the rel. error on its mean is below this")
+    parser.add_option("--min-samples", dest="minSamples", type="int", default=3,
+                      help="Minimum power meter samples per reading with --rel-err")
+    parser.add_option("--max-samples", dest="maxSamples", type="int", default=4,
+                      help="Maximum power meter samples (~1 s each) per reading with --rel-err")
+    parser.add_option("--abs-err", dest="absErr", type="float", default=None,
+                      help="With --rel-err, also stop once the error on the mean is below this (W), e.g. the meter noise")
+    parser.add_option("--fast", dest="fast", action="store_true", default=False,
+                      help="Configure on *OPC? rather than fixed waits, and pipeline INIT/FETCH? readings")
+    parser.add_option("--ring", dest="ring", action="store_true", default=False,
+                      help="Stream timestamped readings and average only those taken after each width change")
+    parser.add_option("--window", dest="window", type="float", default=4.0,
+                      help="Integration window per width with --ring (s)")
+    parser.add_option("--resume", dest="resume", action="store_true", default=False,
+                      help="Keep the widths already in the data file and measure only the missing ones")
+    parser.add_option("--temp-tol", dest="tempTol", type="float", default=2.0,
+                      help="Sensor temperature change allowed when resuming (Celsius)")
+    (options,args) = parser.parse_args()
+
     #Datafile name
     fname = "./data/pin_calib_TellieRange.dat"
 
@@ -143,10 +348,13 @@ if __name__ == "__main__":
     wavelength = 505        # in nm
 
     # Set up range of widths to be run
-    widths = range(0,9000,100)
+    widths = range(options.start, options.stop, options.step)
     print widths
 
-    power_meter = Power_Meter( 1, "power_meter", wavelength, pulse_delay_ms*1e-3, fname )  # ID, name, wavelength [nm], pulse period [s]
+    power_meter = Power_Meter( 1, "power_meter", wavelength, pulse_delay_ms*1e-3, fname,
+                               options.relErr, options.minSamples, options.maxSamples, options.fast,
+                               ring_buffer.SampleRing() if options.ring else None, options.window,
+                               options.resume, options.tempTol, options.absErr )  # ID, name, wavelength [nm], pulse period [s]
     sc = serial_command.SerialCommand('/dev/tty.usbserial-FTGA2OCZ')
 
     LOCK = threading.RLock()
@@ -155,6 +363,7 @@ if __name__ == "__main__":
         ppp_error = 0
         Watt_value = 0
         Watt_error = 0
+        read_count = 0
 
     sc.select_channel(channel)
     sc.set_pulse_width(0)
@@ -183,42 +392,33 @@ if __name__ == "__main__":
     #sc.disable_external_trigger()
         
     ipt = 0
+    done = {}
+    if options.resume:
+        done = dict((w, parse_row(line)) for w, line in checkpoint.compact(fname, 7, header_lines=1).items())
+        print "Info: resuming, %i widths already measured" % len(done)
+    todo = checkpoint.remaining(widths, done)
     data = open(fname,"a")
 
     width = widths[0]
     power_meter.start()
     time.sleep(3)
-    for width in widths:
-        sc.set_pulse_width(width)
-        time.sleep(0.1)
-        sc.fire_continuous()
-        time.sleep(8)
-        tmpPPP = ppp_value
-        tmpPPPErr = ppp_error
-        tmpWatt = Watt_value
-        tmpWattErr = Watt_error
-        time.sleep(1)
-        sc.stop()
-        with LOCK:
-            sc.fire_sequence()
-            #time.sleep(1)
-            pin = None
-            while pin==None:
-                pin, rms, _ = sc.tmp_read_rms()
-            try:
-                dataStr = "%i %i %1.2f %i %i %1.7e %1.2e \n" % (width, int(pin[channel]), float(rms[channel]), tmpPPP, tmpPPPErr, tmpWatt, tmpWattErr)
-                data.write(dataStr)
-                data.flush()
-            except:
-                print "ERROR WITH DATA WRITING"
-                power_meter.exit_flag = 1
-            
-            # Print results
-            print "*********** DATA FOR WIDTH: %4i ************" % (width)
-            outStr = "Width: \t\t%i \nPIN: \t\t%i +/- %1.1f \nPhoton no.: \t%1.4e +/- %1.1e \nWatts: \t\t%1.4e +/- %1.1e" % (width, int(pin[channel]), float(pin[channel]), tmpPPP, tmpPPPErr, tmpWatt, tmpWattErr)
-            print outStr
-            print "*********************************************"
-            print ""
+    if options.adaptive:
+        measure = lambda w: done[w] if w in done else measure_width(sc, channel, data, w)
+        rows = adaptive_sweep(measure, options.start,
+                              options.stop, options.coarseStep, options.fineStep)
+        data.close()
+        done.update(rows)
+        # Rows in width order, through a temporary file so a crash can't lose them
+        header, _ = checkpoint.read_rows(fname, 7, header_lines=1)
+        checkpoint.write_ordered(fname, header, dict((w, ROW_FORMAT % row) for w, row in done.items()))
+        data = open(fname, "a")
+        print "Info: adaptive sweep measured %i widths" % len(rows)
+    else:
+        for w in todo:
+            measure_width(sc, channel, data, w)
 
     power_meter.exit_flag = 1
     data.close()
+    if options.resume:
+        # One row per width, in order, as the file was before it was resumed
+        checkpoint.compact(fname, 7, header_lines=1)
@@ -0,0 +1,139 @@
+#############################################
+# Benchmark power meter set-up time and
+# acquisition rate, legacy vs. fast mode,
+# against a simulated PM100USB so it can be
+# run without the hardware.
+#
+# python power_meter/bench_pm100.py
+#############################################
+import optparse
+import threading
+import time
+import sys
+import os
+import numpy as np
+import pm100
+
+
+class SimulatedPM100(object):
+    """Stand-in for a VISA PM100USB with write/ask.
+
+    latency       -- time per USB round trip (s)
+    sample_period -- time per raw sample the meter averages (s)
+    settle        -- time a configuration command takes to complete (s)
+    """
+
+    def __init__(self, latency=2e-3, sample_period=2e-3, settle=0.02, zero_time=0.5, power=1e-6, noise=1e-8):
+        self.latency = latency
+        self.sample_period = sample_period
+        self.settle = settle
+        self.zero_time = zero_time
+        self.power = power
+        self.noise = noise
+        self.counts = 1
+        self.busy_until = 0.
+        self.zero_done = 0.
+        self.meas_done = None
+        self.round_trips = 0
+        self.lock = threading.Lock()
+
+    def _trip(self):
+        self.round_trips += 1
+        time.sleep(self.latency)
+
+    def _value(self):
+        return self.power + self.noise*np.random.randn() / np.sqrt(self.counts)
+
+    def write(self, cmd):
+        self._trip()
+        now = time.time()
+        cmd = cmd.strip()
+        if cmd.startswith("SENSE:AVERAGE:COUNT"):
+            self.counts = int(cmd.split()[-1])
+        if cmd == "SENSE:CORRECTION:COLLECT:ZERO:INITIATE":
+            self.zero_done = now + self.zero_time
+        if cmd == "INIT":
+            self.meas_done = max(now, self.busy_until) + self.counts*self.sample_period
+        self.busy_until = max(self.busy_until, now) + self.settle
+
+    def ask(self, cmd):
+        self._trip()
+        cmd = cmd.strip()
+        if cmd == "*OPC?":
+            time.sleep(max(0., self.busy_until - time.time()))
+            return "1"
+        if cmd == "READ?":
+            time.sleep(self.counts*self.sample_period)
+            return "%e" % self._value()
+        if cmd == "FETCH?":
+            time.sleep(max(0., self.meas_done - time.time()))
+            return "%e" % self._value()
+        if cmd == "SENSE:CORRECTION:COLLECT:ZERO:STATE?":
+            return "1" if time.time() < self.zero_done else "0"
+        if cmd == "SENSE:AVERAGE:COUNT?":
+            return "%i" % self.counts
+        if cmd == "SENSE:CORRECTION:WAVELENGTH?":
+            return "505"
+        if cmd == "SYSTEM:SENSOR:IDN?":
+            return "S120VC,0,0"
+        if cmd == "SENSE:CORRECTION:COLLECT:ZERO:MAGNITUDE?":
+            return "1.2e-12"
+        return "0"
+
+
+def quietly(func, *args):
+    """Run func with stdout discarded"""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return func(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def bench_init(wait, **kwargs):
+    inst = SimulatedPM100(**kwargs)
+    meter = pm100.PM100(inst, wait)
+    start = time.time()
+    quietly(meter.setup, 505)
+    return time.time() - start, inst.round_trips
+
+def bench_acquire(fast, n_readings, counts, host_time, **kwargs):
+    """Readings per second and raw samples per second, with host_time of
+    processing done on each reading (as Power_Meter.read does)
+    """
+    inst = SimulatedPM100(**kwargs)
+    meter = pm100.PM100(inst, None)
+    meter.set_average_count(counts)
+    sample = meter.read
+    if fast:
+        meter.initiate()
+        sample = meter.read_pipelined
+    start = time.time()
+    for i in range(n_readings):
+        sample()
+        time.sleep(host_time)
+    elapsed = time.time() - start
+    return n_readings / elapsed, n_readings*counts / elapsed
+
+
+###############
+# MAIN FUNCTION
+###############
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-n", dest="readings", type="int", default=20, help="Readings per acquisition benchmark")
+    parser.add_option("--counts", dest="counts", type="int", default=50, help="Samples averaged per reading")
+    parser.add_option("--latency", dest="latency", type="float", default=2e-3, help="Simulated round trip (s)")
+    parser.add_option("--host-time", dest="hostTime", type="float", default=20e-3,
+                      help="Host processing per reading (s)")
+    (options,args) = parser.parse_args()
+
+    sim = {"latency" : options.latency}
+    t_legacy, trips_legacy = bench_init(0.25, **sim)
+    t_fast, trips_fast = bench_init(None, **sim)
+    print "Set-up       : legacy %6.2f s (%i round trips), *OPC? %6.2f s (%i round trips)" % (t_legacy, trips_legacy, t_fast, trips_fast)
+
+    for fast in (False, True):
+        rate, samples = bench_acquire(fast, options.readings, options.counts, options.hostTime, **sim)
+        print "Acquisition  : %-9s %7.1f readings/s %9.0f samples/s" % ("pipelined" if fast else "READ?", rate, samples)
@@ -0,0 +1,199 @@
+#####################################################
+# Continuous linear - quadratic - linear fit with free
+# breakpoints, in numpy/scipy only (no ROOT, no
+# display), for the photons vs. IPW curve.
+#
+#   x <= b1      : a + s1*u
+#   b1 < x <= b2 : a + s1*u + c*u^2          u = x - b1
+#   x > b2       : y(b2) + s3*(x - b2)
+#
+# Parameters are (a, s1, c, s3, b1, b2). The model and
+# its Jacobian are evaluated analytically for all
+# points at once, and fit_batch fits many curves
+# together with a vectorised Levenberg-Marquardt.
+#####################################################
+import numpy as np
+import scipy.optimize
+import scipy.stats
+
+PARAMS = ("a", "s1", "c", "s3", "b1", "b2")
+
+
+def model(x, p):
+    """Evaluate the model at x for parameters p (..., 6), broadcasting
+    over leading axes of p
+    """
+    p = np.asarray(p, dtype=float)
+    a, s1, c, s3, b1, b2 = [p[..., i, np.newaxis] for i in range(6)]
+    x = np.asarray(x, dtype=float)
+    u = x - b1
+    d = b2 - b1
+    y_mid = a + s1*u + c*u*u
+    y_end = a + s1*d + c*d*d + s3*(x - b2)
+    return np.where(x <= b1, a + s1*u, np.where(x <= b2, y_mid, y_end))
+
+def jacobian(x, p):
+    """Derivatives of the model with respect to each parameter,
+    shape (..., n points, 6)
+    """
+    p = np.asarray(p, dtype=float)
+    a, s1, c, s3, b1, b2 = [p[..., i, np.newaxis] for i in range(6)]
+    x = np.asarray(x, dtype=float)
+    u = x - b1
+    d = b2 - b1 + 0*u
+    r1, r3 = x <= b1, x > b2
+    one = np.ones(np.broadcast(x, u).shape)
+    du = np.where(r3, d, u)                             # u, clamped at the second breakpoint
+    jac = np.empty(one.shape + (6,))
+    jac[..., 0] = one
+    jac[..., 1] = np.where(r1, u, du)
+    jac[..., 2] = np.where(r1, 0., du*du)
+    jac[..., 3] = np.where(r3, x - b2, 0.)
+    jac[..., 4] = np.where(r1, -s1, -s1 - 2*c*du)
+    jac[..., 5] = np.where(r3, s1 + 2*c*d - s3, 0.)
+    return jac
+
+def linear_start(x, y, b1, b2, w=None):
+    """Best (a, s1, c, s3) for fixed breakpoints, by linear least squares
+    (the model is linear in them)
+    """
+    p = np.array([0., 0., 0., 0., b1, b2])
+    basis = jacobian(x, p)[:, :4]
+    if w is not None:
+        basis, y = basis*w[:, np.newaxis], y*w
+    coef = np.linalg.lstsq(basis, y, rcond=None)[0]
+    return np.append(coef, [b1, b2])
+
+def guess(x, y, w=None, n_grid=8):
+    """Starting parameters: linear fits over a grid of breakpoint pairs,
+    keeping the best
+    """
+    grid = np.percentile(x, np.linspace(10, 90, n_grid))
+    best, best_chi2 = None, np.inf
+    for i, b1 in enumerate(grid):
+        for b2 in grid[i+1:]:
+            p = linear_start(x, y, b1, b2, w)
+            r = model(x, p) - y
+            chi2 = np.sum((r*w)**2) if w is not None else np.sum(r*r)
+            if chi2 < best_chi2:
+                best, best_chi2 = p, chi2
+    return best
+
+def covariance(jac, resid, absolute_sigma=False):
+    """Parameter covariance from a weighted Jacobian and residuals, scaled
+    by chi2/ndf unless the errors are absolute (as curve_fit)
+    """
+    cov = np.linalg.pinv(np.einsum('...ni,...nj->...ij', jac, jac))
+    if not absolute_sigma:
+        dof = max(resid.shape[-1] - jac.shape[-1], 1)
+        cov = cov*(np.sum(resid*resid, axis=-1) / dof)[..., np.newaxis, np.newaxis]
+    return cov
+
+def fit(x, y, sigma=None, p0=None, absolute_sigma=False):
+    """Fit one curve. Returns (params, covariance)."""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    w = None if sigma is None else 1. / np.asarray(sigma, dtype=float)
+    if p0 is None:
+        p0 = guess(x, y, w)
+    w_arr = np.ones(len(x)) if w is None else w
+    lower = [-np.inf]*4 + [x.min(), x.min()]
+    upper = [np.inf]*4 + [x.max(), x.max()]
+    result = scipy.optimize.least_squares(lambda p: (model(x, p) - y)*w_arr, np.clip(p0, lower, upper),
+                                          jac=lambda p: jacobian(x, p)*w_arr[:, np.newaxis],
+                                          bounds=(lower, upper), x_scale='jac')
+    p = order_breakpoints(result.x)
+    return p, covariance(jacobian(x, p)*w_arr[:, np.newaxis], (model(x, p) - y)*w_arr, absolute_sigma)
+
+def order_breakpoints(p):
+    """Keep b1 <= b2 (the model is only defined for that order)"""
+    p = np.array(p, dtype=float)
+    swap = p[..., 4] > p[..., 5]
+    p[..., 4], p[..., 5] = np.where(swap, p[..., 5], p[..., 4]), np.where(swap, p[..., 4], p[..., 5])
+    return p
+
+def project_linear(x, Y, W, p):
+    """Replace (a, s1, c, s3) of each curve by their least squares values for
+    its breakpoints, solving all curves' normal equations together
+    """
+    basis = jacobian(x, p)[..., :4]*W[..., np.newaxis]
+    lhs = np.einsum('kni,knj->kij', basis, basis) + 1e-300*np.eye(4)
+    rhs = np.einsum('kni,kn->ki', basis, Y*W)
+    p = p.copy()
+    try:
+        p[:, :4] = np.linalg.solve(lhs, rhs[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        pass
+    return p
+
+def fit_batch(x, Y, sigma=None, p0=None, absolute_sigma=False, n_iter=100, tol=1e-10, polish=False):
+    """Fit many curves sampled at the same x, Y of shape (n_curves, n_points),
+    with a Levenberg-Marquardt iteration run on all curves at once. With
+    polish, curves that haven't converged after n_iter are refitted one at
+    a time with fit, starting from where the batch got to.
+    Returns (params (n_curves, 6), covariances (n_curves, 6, 6), converged).
+    """
+    x = np.asarray(x, dtype=float)
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    W = np.ones(Y.shape) if sigma is None else 1. / np.broadcast_to(np.asarray(sigma, dtype=float), Y.shape)
+    if p0 is None:
+        p0 = np.array([guess(x, y, w) for y, w in zip(Y, W)])
+    p = order_breakpoints(np.broadcast_to(np.asarray(p0, dtype=float), (len(Y), 6)))
+    p = project_linear(x, Y, W, p)
+    lo, hi = x.min(), x.max()
+
+    def chi2_of(p):
+        r = (model(x, p) - Y)*W
+        return r, np.sum(r*r, axis=1)
+
+    resid, chi2 = chi2_of(p)
+    lam = np.ones(len(Y))*1e-3
+    converged = np.zeros(len(Y), dtype=bool)
+    for it in range(n_iter):
+        jac = jacobian(x, p)*W[..., np.newaxis]
+        jtj = np.einsum('kni,knj->kij', jac, jac)
+        grad = np.einsum('kni,kn->ki', jac, resid)
+        # Marquardt scaling, kept positive where a parameter has no effect
+        diag = np.diagonal(jtj, axis1=1, axis2=2)
+        diag = diag + 1e-12*diag.max(axis=1)[:, np.newaxis] + 1e-300
+        damp = jtj + lam[:, np.newaxis, np.newaxis]*np.eye(6)*diag[:, np.newaxis, :]
+        step = np.linalg.solve(damp, -grad[..., np.newaxis])[..., 0]
+        trial = p + step
+        trial[:, 4:] = np.clip(trial[:, 4:], lo, hi)
+        trial = project_linear(x, Y, W, order_breakpoints(trial))
+        t_resid, t_chi2 = chi2_of(trial)
+        better = (t_chi2 < chi2) & ~converged
+        done = better & (chi2 - t_chi2 <= tol*np.maximum(chi2, 1e-300))
+        p = np.where(better[:, np.newaxis], trial, p)
+        resid = np.where(better[:, np.newaxis], t_resid, resid)
+        chi2 = np.where(better, t_chi2, chi2)
+        lam = np.where(better, lam*0.3, lam*10.)
+        converged |= done | (lam > 1e12)
+        if converged.all():
+            break
+    cov = covariance(jacobian(x, p)*W[..., np.newaxis], resid, absolute_sigma)
+    if polish:
+        for k in np.flatnonzero(~converged):
+            p_k, cov_k = fit(x, Y[k], 1. / W[k], p[k], absolute_sigma)
+            if np.sum(((model(x, p_k) - Y[k])*W[k])**2) <= chi2[k]:
+                p[k], cov[k] = p_k, cov_k
+            converged[k] = True
+    return p, cov, converged
+
+def param_intervals(p, cov, n_points, alpha=0.05):
+    """Student-t confidence interval on each parameter, as conf_intervals
+    in calibration.py. Returns (..., 6, 2).
+    """
+    tval = scipy.stats.distributions.t.ppf(1.-alpha/2., max(0, n_points - len(PARAMS)))
+    sigma = np.sqrt(np.diagonal(cov, axis1=-2, axis2=-1))
+    return np.stack([p - sigma*tval, p + sigma*tval], axis=-1)
+
+def confidence_band(x, p, cov, n_points, alpha=0.05):
+    """Delta method confidence band on the fitted curve at x.
+    Returns (y, lower, upper).
+    """
+    y = model(x, p)
+    jac = jacobian(x, p)
+    var = np.einsum('...ni,...ij,...nj->...n', jac, cov, jac)
+    tval = scipy.stats.distributions.t.ppf(1.-alpha/2., max(0, n_points - len(PARAMS)))
+    half = tval*np.sqrt(np.maximum(var, 0.))
+    return y, y - half, y + half
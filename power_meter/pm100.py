@@ -0,0 +1,105 @@
+#############################################
+# SCPI control of the Thorlabs PM100USB power
+# meter, independent of the VISA library so it
+# can be driven by any object with write/ask
+# (a visa.instrument, or a simulated meter).
+#############################################
+import time
+
+pW = 1e-12       # 1 pico Watt
+
+
+class PM100(object):
+    """Set-up and acquisition for a PM100USB.
+
+    wait -- fixed delay (s) before each command, as originally used. If None,
+            each configuration command is instead completed on *OPC?.
+    """
+
+    def __init__(self, instrument, wait=None):
+        self.inst = instrument
+        self.wait = wait
+        self.counts = None
+
+    def _pause(self):
+        if self.wait:
+            time.sleep(self.wait)
+
+    def command(self, cmd):
+        """Send a configuration command and wait for it to complete"""
+        self._pause()
+        self.inst.write(cmd)
+        if self.wait is None:
+            self.inst.ask("*OPC?")
+
+    def query(self, cmd):
+        self._pause()
+        return self.inst.ask(cmd)
+
+    def setup(self, wavelength, zero_counts=3000, counts=500):
+        """Reset and configure for power readings at a wavelength (nm),
+        then take a zero. Returns (sensor temperature, pedestal in W).
+        """
+        self.command("*RST")
+        print "Info: Instrument ID:",   self.query("*IDN?")
+        print "Info: Self test status:",self.query("*TST?")
+        print "Info: System version: ", self.query("SYSTEM:VERSION?")
+        response = self.query("SYSTEM:SENSOR:IDN?"); print "Info: Sensor ID is ",response.split(",")[0]
+
+        self.command("CONFIGURE:SCALAR:TEMPERATURE")
+        temperature = float(self.query("READ?")); print "Info: Sensor temperature is %.1f Celsius" % temperature
+
+        self.command("CONFIGURE:SCALAR:POWER")
+        self.command("POWER:DC:UNIT W")
+        print "Info: Unit for DC power is now : ",self.query("POWER:DC:UNIT?")
+
+        self.command("SENSE:CORRECTION:WAVELENGTH "+str(int(wavelength)))
+        nm = float(self.query("SENSE:CORRECTION:WAVELENGTH?")); print "Info: Wavelength now set to [nm]: ",int(nm)
+        self.set_average_count(zero_counts)
+        print "Info: Samples per average pre zero adjustment: ",self.counts
+
+        print "Info: Configuration is set to : ", self.query("CONFIGURE?")
+        print "Info: Power auto range status : ", self.query("POWER:RANGE:AUTO?")
+
+        #-- zero suppression
+        self.command("SENSE:CORRECTION:COLLECT:ZERO:INITIATE")
+        state = 1
+        while state > 0 :
+            if self.wait is None:
+                time.sleep(0.05)
+            state = int(self.query("SENSE:CORRECTION:COLLECT:ZERO:STATE?"))
+            print "Info: Zero adjustment (1=waiting, 0=done) : %s" % (state)
+        ped = float(self.query("SENSE:CORRECTION:COLLECT:ZERO:MAGNITUDE?"))
+        print "Info: Pedestal [pW] : %s" % (ped/pW)
+
+        #-- reduce counts per average (1 count takes 2 ms)
+        self.set_average_count(counts)
+        print "Info: Samples per average post zero adjustment: %i" % self.counts
+        return temperature, ped
+
+    def set_average_count(self, counts):
+        """Number of raw samples the meter averages into each reading"""
+        self.command("SENSE:AVERAGE:COUNT %i " % counts)
+        self.counts = int(self.query("SENSE:AVERAGE:COUNT?"))
+        return self.counts
+
+    def read(self):
+        """One averaged reading: measure, then return it (one round trip)"""
+        return float(self.inst.ask("READ?"))
+
+    def initiate(self):
+        """Start an averaged measurement without waiting for it"""
+        self.inst.write("INIT")
+
+    def fetch(self):
+        """Return the result of the last initiated measurement"""
+        return float(self.inst.ask("FETCH?"))
+
+    def read_pipelined(self):
+        """Fetch the running measurement and immediately start the next one,
+        so the meter is averaging while the host handles the result and the
+        next round trip. initiate() must have been called once beforehand.
+        """
+        value = self.fetch()
+        self.initiate()
+        return value
@@ -0,0 +1,45 @@
+#############################################
+# Fixed-size ring buffer of timestamped power
+# meter readings. The acquisition thread pushes
+# every reading; the sweep then asks for the
+# statistics of readings taken entirely within
+# a time window.
+#############################################
+import threading
+import numpy as np
+
+
+class SampleRing(object):
+    """Thread-safe ring of (start time, end time, value) samples"""
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.t_start = np.zeros(size)
+        self.t_end = np.zeros(size)
+        self.value = np.zeros(size)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def push(self, t_start, t_end, value):
+        with self.lock:
+            i = self.count % self.size
+            self.t_start[i] = t_start
+            self.t_end[i] = t_end
+            self.value[i] = value
+            self.count += 1
+
+    def samples(self, t0, t1=None):
+        """Values of all samples measured wholly inside [t0, t1]"""
+        with self.lock:
+            n = min(self.count, self.size)
+            sel = self.t_start[:n] >= t0
+            if t1 is not None:
+                sel &= self.t_end[:n] <= t1
+            return self.value[:n][sel].copy()
+
+    def window(self, t0, t1=None):
+        """Return (mean, std, n) of the samples inside [t0, t1]"""
+        values = self.samples(t0, t1)
+        if len(values) == 0:
+            return 0., 0., 0
+        return np.mean(values), np.std(values), len(values)
@@ -0,0 +1,8 @@
+# The scripts import each other as top level modules (see env.sh), so put
+# their directories on the path for the tests
+import os
+import sys
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for sub in ("PMT_cal", "common", "power_meter"):
+    sys.path.insert(0, os.path.join(TOP, sub))
@@ -0,0 +1,24 @@
+import numpy as np
+import bootstrap
+
+
+def test_mean_spread_is_sigma_over_sqrt_n():
+    rng = np.random.RandomState(1)
+    n, sigma = 200, 2.
+    gain = 10. + sigma*rng.randn(n)
+    photons = np.linspace(1e3, 1e4, n)
+    result = bootstrap.bootstrap_gain(photons, gain, np.ones(n), weights=np.ones(n), n_boot=4000, seed=2)
+    np.testing.assert_allclose(result["mean_err"], gain.std() / np.sqrt(n), rtol=0.05)
+    np.testing.assert_allclose(result["mean_err"], sigma / np.sqrt(n), rtol=0.15)
+    assert result["mean_lo"] < gain.mean() < result["mean_hi"]
+
+def test_resample_counts():
+    counts = bootstrap.resample(7, n_boot=50, seed=0)
+    assert counts.shape == (50, 7)
+    assert np.all(counts.sum(axis=1) == 7)
+
+def test_too_few_points_gives_nan():
+    for n in (0, 1):
+        result = bootstrap.bootstrap_gain(np.ones(n), np.ones(n), np.ones(n), n_boot=10)
+        assert result["n_boot"] == 10
+        assert all(np.isnan(result[key]) for key in bootstrap.KEYS)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+# calibration reads raw pickles through calc_utils (see env.sh)
+pytest.importorskip("calc_utils")
+import calibration
+
+N_COLS = len(calibration.SCAN_DTYPE.names)
+HEADER = "#PWIDTH\tPWIDTH Error\tPIN\n"
+
+
+def scan_line(width):
+    return "\t".join(str(v) for v in [width] + range(1, N_COLS)) + "\n"
+
+def test_read_scope_scan(tmpdir):
+    scan = tmpdir.join("scan.dat")
+    scan.write(HEADER + scan_line(100) + scan_line(200))
+    data = calibration.read_scope_scan(str(scan))
+    assert list(data["ipw"]) == [100, 200]
+
+def test_read_scope_scan_drops_incomplete_lines(tmpdir, capsys):
+    scan = tmpdir.join("scan.dat")
+    scan.write(HEADER + scan_line(100) + "200\t1\t2\n" + scan_line(300))
+    data = calibration.read_scope_scan(str(scan))
+    assert list(data["ipw"]) == [100, 300]
+    assert "left out 1 incomplete line" in capsys.readouterr()[1]
+
+def test_read_empty_scope_scan_is_quiet(tmpdir, capsys):
+    scan = tmpdir.join("scan.dat")
+    scan.write(HEADER)
+    assert len(calibration.read_scope_scan(str(scan))) == 0
+    assert capsys.readouterr()[1] == ""
+
+def test_match_widths_pairs_by_width(capsys):
+    scan_idx, pm_idx = calibration.match_widths([300, 100, 400], [100, 200, 300])
+    assert list(scan_idx) == [1, 0] and list(pm_idx) == [0, 2]
+    err = capsys.readouterr()[1]
+    assert "[400]" in err and "[200]" in err
+
+def test_match_widths_rejects_repeats():
+    with pytest.raises(ValueError):
+        calibration.match_widths([100, 100], [100])
+
+def test_gain_is_aligned_to_the_power_meter_rows():
+    scan = np.zeros(2, dtype=calibration.SCAN_DTYPE)
+    scan["ipw"], scan["area"], scan["area_err"] = [300, 100], [3e-9, 1e-9], [1e-11, 1e-11]
+    photons = np.array([1e3, 2e3, 3e3])
+    gain, gain_err = calibration.calcGain(scan, np.array([100, 200, 300]), photons, 0.01*photons)
+    assert np.isnan(gain[1]) and np.isnan(gain_err[1])
+    np.testing.assert_allclose(gain[2], gain[0])
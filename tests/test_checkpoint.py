@@ -0,0 +1,59 @@
+import pytest
+import checkpoint
+
+HEADER = "505 2.50e-05 40000 24.1 1.000e-09 \n"
+
+
+def row(width, value=1.):
+    return "%i %i %1.2f %i %i %1.7e %1.2e \n" % (width, 10, 0.5, 1000, 30, value, 1e-12)
+
+def test_read_rows_keeps_complete_rows(tmpdir):
+    data = tmpdir.join("pm.dat")
+    data.write(HEADER + row(200) + row(100) + "\n" + row(300)[:-1])
+    dropped = []
+    header, rows = checkpoint.read_rows(str(data), 7, header_lines=1, dropped=dropped)
+    assert header == [HEADER]
+    assert sorted(rows) == [100, 200]
+    assert dropped == [(5, "incomplete line")]
+
+def test_read_rows_drops_malformed_rows(tmpdir):
+    data = tmpdir.join("pm.dat")
+    data.write(HEADER + row(100) + "200 1 2\n" + row(300).replace("1000", "x") + row(400).replace("1.0000000e+00", "nan")
+               + row(500))
+    dropped = []
+    header, rows = checkpoint.read_rows(str(data), 7, header_lines=1, dropped=dropped,
+                                        valid=lambda width, values: width != 500)
+    assert sorted(rows) == [100]
+    assert [line for line, reason in dropped] == [3, 4, 5, 6]
+
+def test_repeated_width_keeps_the_last(tmpdir):
+    data = tmpdir.join("pm.dat")
+    data.write(HEADER + row(100, 1.) + row(100, 2.))
+    dropped = []
+    header, rows = checkpoint.read_rows(str(data), 7, header_lines=1, dropped=dropped)
+    assert rows[100] == row(100, 2.)
+    assert dropped == [(2, "width 100 repeated on line 3")]
+
+def test_compact_orders_and_reports(tmpdir, capsys):
+    data = tmpdir.join("pm.dat")
+    data.write(HEADER + row(300) + row(100) + row(200) + row(100, 2.) + "400 1")
+    rows = checkpoint.compact(str(data), 7, header_lines=1)
+    assert sorted(rows) == [100, 200, 300]
+    assert data.read() == HEADER + row(100, 2.) + row(200) + row(300)
+    out = capsys.readouterr()[0]
+    assert "dropped line 3 (width 100 repeated on line 5)" in out
+    assert "dropped line 6 (incomplete line)" in out
+    assert not tmpdir.join("pm.dat.tmp").check()
+
+def test_remaining_keeps_sweep_order():
+    assert checkpoint.remaining([300, 100, 200, 400], {100 : "", 400 : ""}) == [300, 200]
+
+def test_conditions_round_trip_and_check():
+    conditions = {"Wavelength" : 505, "Temp" : 24.1, "Voltage" : 1.1}
+    old = checkpoint.parse_conditions(["#HEADER\n", checkpoint.format_conditions(conditions)])
+    tolerances = {"Wavelength" : 0, "Temp" : 2., "Voltage" : 1e-3}
+    checkpoint.check_conditions(old, dict(conditions, Temp=25.), tolerances)
+    with pytest.raises(ValueError):
+        checkpoint.check_conditions(old, dict(conditions, Voltage=1.2), tolerances)
+    with pytest.raises(ValueError):
+        checkpoint.check_conditions({}, conditions, tolerances)
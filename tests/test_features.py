@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+# features reads pickles through calc_utils (TELLIE_calibration_code, see env.sh)
+pytest.importorskip("calc_utils")
+import features
+
+X_INCR = 1e-9
+
+
+def triangle(amp, offset=0.05, n_samples=100):
+    """Negative going pulse on a flat baseline: linear from 0 at sample 30
+    to -amp at 40, and back to 0 at 60
+    """
+    s = np.arange(n_samples, dtype=float)
+    p = np.interp(s, [0, 30, 40, 60, n_samples-1], [0, 0, amp, 0, 0])
+    return offset - p
+
+def test_crossings_of_a_known_pulse():
+    y = np.array([triangle(0.2), triangle(0.05, offset=-0.01)])
+    result = features.extract(y, X_INCR)
+    # 10/50/90% of the leading edge at samples 31/35/39, trailing at 58/50/42;
+    # the area is the triangle's, amp*30/2 samples, into 50 Ohm
+    np.testing.assert_allclose(result["fall"], 8*X_INCR)
+    np.testing.assert_allclose(result["rise"], 16*X_INCR)
+    np.testing.assert_allclose(result["width"], 15*X_INCR)
+    np.testing.assert_allclose(result["peak"], [-0.2, -0.05])
+    np.testing.assert_allclose(result["area"], np.array([0.2, 0.05])*15*X_INCR / 50.)
@@ -0,0 +1,30 @@
+import instrument_tasks
+
+
+def test_union_time_of_overlapping_calls():
+    trace = instrument_tasks.OverlapTrace()
+    trace.record("scope", "a", 0., 2.)
+    trace.record("writer", "b", 1., 3.)
+    trace.record("scope", "c", 5., 6.)
+    assert trace.busy_time() == {"scope" : 3., "writer" : 2.}
+    assert trace.union_time() == 4.
+
+def test_worker_runs_in_order_and_records(tmpdir):
+    trace = instrument_tasks.OverlapTrace()
+    worker = instrument_tasks.DeviceWorker("writer", trace)
+    done = []
+    tasks = [worker.submit(done.append, i) for i in range(5)]
+    failed = worker.submit(int, "x")
+    worker.close()
+    assert done == range(5)
+    assert [t.result() for t in tasks] == [None]*5
+    try:
+        failed.result()
+    except ValueError:
+        pass
+    else:
+        assert False, "error in the call not re-raised"
+    assert len(trace.records) == 6
+    fileName = str(tmpdir.join("trace.dat"))
+    trace.write(fileName)
+    assert len(open(fileName).readlines()) == 7
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+# live_gain uses the calibration code, which needs calc_utils (see env.sh)
+pytest.importorskip("calc_utils")
+import calibration
+import live_gain
+
+
+def test_running_mean_matches_np_average():
+    rng = np.random.RandomState(3)
+    values = 1e7*(1. + 0.1*rng.randn(40))
+    weights = 1. / (1e5*(1. + rng.rand(40)))**2
+    running = live_gain.RunningWeightedMean()
+    for i, (value, weight) in enumerate(zip(values, weights)):
+        running.add(value, weight)
+        if i == 0:
+            continue
+        mean, std = running.result()
+        np.testing.assert_allclose(mean, np.average(values[:i+1], weights=weights[:i+1]), rtol=1e-12)
+        np.testing.assert_allclose((mean, std), calibration.weighted_avg_and_std(values[:i+1], weights[:i+1]),
+                                   rtol=1e-9)
+    assert running.n == len(values)
+
+def test_running_mean_skips_zero_weights():
+    running = live_gain.RunningWeightedMean()
+    assert np.isnan(running.result()[0])
+    running.add(5., 0.)
+    running.add(2., 1.)
+    running.add(4., 3.)
+    np.testing.assert_allclose(running.result()[0], 3.5)
+    assert running.n == 2
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+# pe_fit reads traces through features, which needs calc_utils (see env.sh)
+pytest.importorskip("calc_utils")
+import pe_fit
+import pmt_gain
+import waveform_store
+
+GAIN = 2e6
+X_INCR = 1e-9
+N_TRACES = 4000
+# Light levels from resolved single PE peaks to well past resolve_mu
+MUS = {100 : 0.8, 200 : 1.5, 300 : 3., 400 : 6., 500 : 15., 600 : 30., 700 : 60., 800 : 100., 900 : 150.,
+       1000 : 200.}
+
+
+def simulate_store(path, seed=4, q0=0.02, sigma0=0.05, resolution=0.35):
+    """Store of traces whose charges follow the PE model: a flat zero
+    baseline and all the charge in one sample
+    """
+    rng = np.random.RandomState(seed)
+    q1 = GAIN*pmt_gain.E_CHARGE / pe_fit.UNIT
+    store = waveform_store.WaveformStore(str(path))
+    for width, mu in sorted(MUS.items()):
+        n = rng.poisson(mu, N_TRACES)
+        q = q0 + n*q1 + rng.randn(N_TRACES)*np.sqrt(sigma0**2 + n*(resolution*q1)**2)
+        y = np.zeros((N_TRACES, 30))
+        # charge (pC) = -sum(y)*x_incr/50 Ohm
+        y[:, 25] = -q*pe_fit.UNIT*50. / X_INCR
+        store.append(width, y, 0., X_INCR)
+    return str(path)
+
+def test_parallel_fit_matches_serial(tmpdir):
+    rawDir = simulate_store(tmpdir)
+    widths = sorted(MUS.keys())
+    serial = pe_fit.fit_scan(rawDir, widths, workers=1)
+    parallel = pe_fit.fit_scan(rawDir, widths, workers=3)
+    assert np.all(serial["width"] == widths) and np.all(parallel["width"] == widths)
+    assert np.all(serial["ok"]) and np.all(parallel["ok"])
+    np.testing.assert_allclose(parallel["gain"], serial["gain"], rtol=5e-3)
+    np.testing.assert_allclose(parallel["mu"], serial["mu"], rtol=5e-3)
+    # and both find the simulated gain where the peaks are resolved
+    np.testing.assert_allclose(serial["gain"][:4], GAIN, rtol=0.05)
@@ -0,0 +1,28 @@
+import numpy as np
+import piecewise_fit
+
+# Breakpoints at 3 and 7, with no sample on either
+X = np.linspace(0.1, 9.9, 50)
+P = np.array([1., 0.5, 0.02, 2., 3., 7.])
+
+
+def numeric_jacobian(x, p, step=1e-6):
+    """Central differences of the model in each parameter"""
+    jac = np.empty((len(x), len(p)))
+    for i in range(len(p)):
+        dp = np.zeros(len(p))
+        dp[i] = step*max(abs(p[i]), 1.)
+        jac[:, i] = (piecewise_fit.model(x, p + dp) - piecewise_fit.model(x, p - dp)) / (2*dp[i])
+    return jac
+
+def test_jacobian_matches_finite_differences():
+    jac = piecewise_fit.jacobian(X, P)
+    assert jac.shape == (len(X), 6)
+    np.testing.assert_allclose(jac, numeric_jacobian(X, P), rtol=1e-6, atol=1e-8)
+
+def test_jacobian_batch():
+    ps = np.array([P, [0., -1., 0.1, 0.5, 2.05, 8.05]])
+    jac = piecewise_fit.jacobian(X, ps)
+    assert jac.shape == (2, len(X), 6)
+    for p, j in zip(ps, jac):
+        np.testing.assert_allclose(j, numeric_jacobian(X, p), rtol=1e-6, atol=1e-8)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import pm_data
+
+HEADER = "505 2.50e-05 40000 24.1 1.000e-09 \n"
+ROWS = "100 10 0.50 1000 30 1.0000000e-09 1.00e-12 \n200 20 0.70 2000 40 2.0000000e-09 2.00e-12 \n"
+
+
+def test_read_power_meter_file(tmpdir):
+    data = tmpdir.join("pm.dat")
+    data.write(HEADER + ROWS)
+    header, rows = pm_data.read_power_meter_file(str(data))
+    assert header == {"Wavelength" : 505, "Pulse sep" : 2.5e-5, "Rate" : 40000, "Temp" : 24.1, "Pedestal" : 1e-9}
+    assert list(rows["width"]) == [100, 200]
+    np.testing.assert_allclose(rows["pin_rms"], [0.5, 0.7])
+    np.testing.assert_allclose(rows["watts"], [1e-9, 2e-9])
+
+def test_old_files_without_pin_rms():
+    rows = pm_data.parse_rows("100 10 1000 30 1e-9 1e-12\n200 20 2000 40 2e-9 2e-12\n")
+    assert list(rows["photons"]) == [1000, 2000]
+    assert np.all(rows["pin_rms"] == 0)
+
+def test_blank_lines_and_empty_files():
+    assert len(pm_data.parse_rows(ROWS + "\n\n")) == 2
+    assert len(pm_data.parse_rows("")) == 0
+
+@pytest.mark.parametrize("text", [
+    ROWS + "300 30 0.9 3000 50 3e-9\n",                     # short row
+    ROWS.replace("2000", "x"),                              # value fromstring stops at
+    "100 10 0.50 1000 30 1e-9 1e-12\n200 x 1 2 3 4 5\n",    # bad value on a row boundary
+    "100 10 0.50 1000\n",                                   # unknown column count
+])
+def test_malformed_rows_raise(text):
+    with pytest.raises(ValueError):
+        pm_data.parse_rows(text)
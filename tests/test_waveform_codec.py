@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import waveform_codec as codec
+
+PREAMBLE = {"YMULT" : 4e-3, "YOFF" : 10., "YZERO" : 1.3e-3, "XINCR" : 1e-9, "BYT_NR" : 1}
+
+
+def random_codes(shape, byt_nr=1, seed=5):
+    info = np.iinfo(codec.CODE_TYPES[byt_nr])
+    return np.random.RandomState(seed).randint(info.min, info.max + 1, size=shape).astype(codec.CODE_TYPES[byt_nr])
+
+@pytest.mark.parametrize("byt_nr", [1, 2])
+def test_codes_round_trip(byt_nr):
+    preamble = dict(PREAMBLE, BYT_NR=byt_nr)
+    codes = random_codes((20, 50), byt_nr)
+    back = codec.to_codes(codec.to_volts(codes, preamble), preamble)
+    assert back.dtype == codes.dtype
+    assert np.all(back == codes)
+
+def test_off_grid_volts_raise():
+    y = codec.to_volts(random_codes((5, 50)), PREAMBLE)
+    with pytest.raises(ValueError):
+        codec.to_codes(y + 0.3*PREAMBLE["YMULT"], PREAMBLE)
+
+def test_out_of_range_volts_raise():
+    with pytest.raises(ValueError):
+        codec.to_codes(np.array([1000*PREAMBLE["YMULT"]]), PREAMBLE)
+
+def test_infer_preamble_of_digitised_volts():
+    y = codec.to_volts(random_codes((50, 100)), PREAMBLE)
+    preamble = codec.infer_preamble(y, 1, 1e-9)
+    np.testing.assert_allclose(preamble["YMULT"], PREAMBLE["YMULT"])
+    np.testing.assert_allclose(codec.to_volts(codec.to_codes(y, preamble), preamble), y, atol=1e-12)
+
+def test_infer_preamble_rejects_volts_off_any_grid():
+    y = codec.to_volts(random_codes((50, 100)), PREAMBLE)
+    rng = np.random.RandomState(6)
+    with pytest.raises(ValueError):
+        codec.infer_preamble(0.5*y + 1e-3*PREAMBLE["YMULT"]*rng.rand(*y.shape))
+
+@pytest.mark.parametrize("encoding", codec.ENCODINGS)
+def test_encode_decode(encoding):
+    codes = random_codes((23, 40), 2)
+    blob = codec.encode(codes, encoding, block_traces=5)
+    dtype = codes.dtype
+    assert np.all(codec.decode(blob, 23, 40, dtype, encoding, block_traces=5) == codes)
+    for traces in (slice(3, 12), np.array([22, 0, 7]), 11):
+        assert np.all(codec.decode(blob, 23, 40, dtype, encoding, traces, block_traces=5) == codes[traces])
+    volts = codec.decode(blob, 23, 40, dtype, encoding, block_traces=5, preamble=PREAMBLE, volts=True)
+    np.testing.assert_allclose(volts, codec.to_volts(codes, PREAMBLE))
+
+def test_delta_wraps():
+    codes = np.array([[127, -128, 0, 5]], dtype=np.int8)
+    assert np.all(codec.undelta(codec.delta(codes)) == codes)
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        codec.encode(np.zeros((1, 4), dtype=np.int8), "lz4")
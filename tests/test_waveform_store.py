@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+# the store reads the sweep's pickles through calc_utils (see env.sh)
+pytest.importorskip("calc_utils")
+import waveform_codec as codec
+import waveform_store
+
+PREAMBLE = {"YMULT" : 4e-3, "YOFF" : 0., "YZERO" : 0., "XINCR" : 1e-9, "BYT_NR" : 1}
+
+
+def codes(n_traces=30, n_samples=40, seed=7):
+    return np.random.RandomState(seed).randint(-128, 128, size=(n_traces, n_samples)).astype(np.int8)
+
+def test_volts_round_trip(tmpdir):
+    y = np.random.RandomState(8).randn(10, 20)
+    store = waveform_store.WaveformStore(str(tmpdir))
+    store.append(100, y, 0., 1e-9)
+    again = waveform_store.WaveformStore(str(tmpdir))
+    assert again.widths() == [100]
+    assert again.preamble(100) is None
+    assert np.all(again.read(100) == y)
+
+@pytest.mark.parametrize("encoding", codec.ENCODINGS)
+def test_codes_round_trip(tmpdir, encoding):
+    c = codes()
+    store = waveform_store.WaveformStore(str(tmpdir))
+    store.append(200, codec.to_volts(c, PREAMBLE), 0., 1e-9, PREAMBLE, encoding)
+    store.append(100, c[:5], 0., 1e-9, PREAMBLE, encoding)
+    again = waveform_store.WaveformStore(str(tmpdir))
+    assert again.widths() == [100, 200]
+    assert np.all(again.read(200) == c)
+    assert np.all(again.read(100) == c[:5])
+    np.testing.assert_allclose(again.read(200, slice(4, 9), volts=True), codec.to_volts(c[4:9], PREAMBLE))
+
+def test_raw_reads_are_memory_mapped_slices(tmpdir):
+    c = codes()
+    store = waveform_store.WaveformStore(str(tmpdir))
+    store.append(100, c[:3], 0., 1e-9, PREAMBLE)
+    store.append(200, c, 0., 1e-9, PREAMBLE)
+    y = store.read(200, slice(10, 20))
+    assert isinstance(y, np.memmap)
+    assert np.all(y == c[10:20])
+    assert np.all(store.read(200, np.array([29, 0])) == c[[29, 0]])
+
+def test_compressed_needs_a_preamble(tmpdir):
+    store = waveform_store.WaveformStore(str(tmpdir))
+    with pytest.raises(ValueError):
+        store.append(100, np.zeros((2, 5)), encoding="zlib")
+
+def test_append_pickle_falls_back_to_volts(tmpdir, monkeypatch, capsys):
+    x = 1e-9*np.arange(40)
+    on_grid = codec.to_volts(codes(), PREAMBLE)
+    off_grid = on_grid + 0.3*PREAMBLE["YMULT"]
+    traces = {"on.pkl" : on_grid, "off.pkl" : off_grid}
+    monkeypatch.setattr(waveform_store.calc, "readPickleChannel", lambda fileName, chan: (x, traces[fileName]))
+    store = waveform_store.WaveformStore(str(tmpdir))
+    store.append_pickle(100, "on.pkl", encoding="zlib", byt_nr=1)
+    store.append_pickle(200, "off.pkl", preamble=PREAMBLE, encoding="zlib")
+    assert "Width 200 stored as volts" in capsys.readouterr()[1]
+    assert store.preamble(100) is not None
+    np.testing.assert_allclose(store.read(100, volts=True), on_grid, atol=1e-12)
+    assert store.preamble(200) is None and store.index[200]["encoding"] == "raw"
+    assert np.all(store.read(200) == off_grid)
+
+def test_open_store_sees_appended_widths(tmpdir):
+    path = str(tmpdir)
+    waveform_store.WaveformStore(path).append(100, np.zeros((2, 5)))
+    assert waveform_store.open_store(path).widths() == [100]
+    waveform_store.WaveformStore(path).append(200, np.ones((2, 5)))
+    assert waveform_store.open_store(path).widths() == [100, 200]